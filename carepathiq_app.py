@@ -1,12 +1,30 @@
 import streamlit as st
 print("--- RELOADING APP WITH NEW THEME ---")
-import urllib.request
 import urllib.parse
+import collections
+import functools
+import hashlib
+import itertools
 import json
+import os
+import random
+import re
+import secrets
+import string
+import threading
 import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import requests
 from openai import OpenAI
 import streamlit.components.v1 as components
 
+try:
+    import orjson
+except ImportError:  # optional: faster JSON decoding for PubMed responses
+    orjson = None
+
 st.set_page_config(page_title="CarePathIQ", layout="wide", page_icon="🏥")
 
 # Force button color with CSS injection
@@ -29,7 +47,7 @@ st.title("Clinical Pathway Agent")
 # st.markdown("A multi-phase, conversational Clinical Pathway Agent to build evidence-based clinical pathways.")
 
 # --- Conversational dialogue library (restored from CLI prompts) ---
-dialogue = {
+dialogue = types.MappingProxyType({
     "intro": "Hello! I'm your Clinical Pathway Agent. I'm here to help you transform your clinical expertise and evidence-based medicine into a robust clinical pathway.",
     "phase_1_start": "Let's kick things off with the Scope. I'll ask you a few questions to frame the problem accurately.",
     "phase_2_intro": "Great job on the scope. Now, let's look at the science. We need to make sure our pathway is evidence-based. Ready to evaluate some evidence?",
@@ -40,20 +58,50 @@ dialogue = {
     "approval_request": ">> Do you approve this section? (Type 'YES' to proceed, anything else to abort): ",
     "locked": "Section approved. Updating Documentation...",
     "summary_generated": "The formal summary has been saved to '{filename}'."
-}
+})
+# Opening message for each phase (Phase 1 opens with the scope prompt)
+PHASE_INTROS = types.MappingProxyType({1: dialogue['phase_1_start'], **{i: dialogue[f'phase_{i}_intro'] for i in range(2, 6)}})
+
+PUBMED_BASE_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+DEFAULT_MODEL = "gpt-4o-mini"
+CHAT_HISTORY_WINDOW = 20  # chat messages drawn per rerun; older ones sit behind a toggle
+MAX_CHAT_MESSAGES = 200  # chat messages kept in session state
+
+MERMAID_JS_URL = 'https://cdn.jsdelivr.net/npm/mermaid@10/dist/mermaid.esm.min.mjs'
+
+_MERMAID_TEMPLATE = string.Template("""
+<link rel="modulepreload" href="$js_url">
+<div class="mermaid">$code</div>
+<script type="module">
+    import mermaid from '$js_url';
+    mermaid.initialize({ startOnLoad: false });
+    mermaid.run();
+</script>
+""")
+
+@st.cache_resource(show_spinner=False)
+def get_openai_client(api_key):
+    """One OpenAI client (and connection pool) per API key, reused across reruns."""
+    # Bounded so a slow endpoint can't hang the script thread; the SDK retries with backoff
+    return OpenAI(api_key=api_key, timeout=20.0, max_retries=3)
 
 # --- API key input (UI-first template) ---
 openai_api_key = st.sidebar.text_input("OpenAI API Key", type="password")
 use_llm = False
 client = None
+# Namespaces cached LLM output per key so different users never share results
+api_key_hash = hashlib.sha256(openai_api_key.encode()).hexdigest() if openai_api_key else ''
 if openai_api_key:
     try:
-        client = OpenAI(api_key=openai_api_key)
+        client = get_openai_client(openai_api_key)
         use_llm = True
         st.sidebar.success("LLM connected")
     except Exception as e:
         st.sidebar.error(f"LLM init error: {e}")
 
+st.sidebar.toggle('Conversational transitions (slower)', value=False, key='enable_dynamic_transitions',
+                  help='Let the LLM rephrase each guided question based on your previous answer. Adds one LLM call per answer.')
+
 # Sidebar onboarding for API key (quick steps + test button)
 with st.sidebar.expander("How to get & test your OpenAI API key", expanded=False):
     st.markdown(
@@ -78,7 +126,7 @@ with st.sidebar.expander("How to get & test your OpenAI API key", expanded=False
         else:
             if not client:
                 try:
-                    client = OpenAI(api_key=openai_api_key)
+                    client = get_openai_client(openai_api_key)
                     use_llm = True
                 except Exception as e:
                     st.error(f"Could not initialize client: {e}")
@@ -87,8 +135,9 @@ with st.sidebar.expander("How to get & test your OpenAI API key", expanded=False
                 try:
                     # lightweight test: ask the model for a 1-word reply
                     resp = client.chat.completions.create(
-                        model="gpt-3.5-turbo",
+                        model=DEFAULT_MODEL,
                         messages=[{"role": "user", "content": "Reply with the single word: READY"}],
+                        max_tokens=4,
                         temperature=0,
                         stream=False,
                     )
@@ -111,9 +160,66 @@ with st.sidebar.expander("How to get & test your OpenAI API key", expanded=False
                     else:
                         st.error(f"API key test failed: {e}")
 
+# --- Checkpointing: pathway_data survives browser refreshes and server restarts ---
+CHECKPOINT_DIR = Path('.carepathiq_ckpt')
+CHECKPOINT_MAX_AGE = 30 * 24 * 60 * 60  # seconds since last save before a checkpoint is deleted
+
+def _checkpoint_path():
+    # The session id lives in the URL so a refreshed tab finds its checkpoint again
+    sid = st.query_params.get('sid', '')
+    if not re.fullmatch(r'[0-9a-f]{16}', sid):
+        sid = secrets.token_hex(8)
+        st.query_params['sid'] = sid
+    return CHECKPOINT_DIR / f'{sid}.json'
+
+def _dumps(data):
+    return orjson.dumps(data) if orjson else json.dumps(data).encode()
+
+def load_checkpoint():
+    path = _checkpoint_path()
+    try:
+        raw = path.read_bytes()
+        data = orjson.loads(raw) if orjson else json.loads(raw)
+    except (OSError, ValueError):
+        return None
+    st.session_state._checkpoint_bytes = raw
+    return data
+
+def save_checkpoint():
+    """Write pathway_data to this session's checkpoint if it changed since the last write."""
+    try:
+        raw = _dumps(st.session_state.pathway_data)
+    except (TypeError, ValueError):
+        return  # something non-JSON slipped into pathway_data; skip checkpointing rather than break every rerun
+    if raw == st.session_state.get('_checkpoint_bytes'):
+        return
+    path = _checkpoint_path()
+    try:
+        CHECKPOINT_DIR.mkdir(exist_ok=True)
+        # Write-then-rename so a crash mid-write never leaves a truncated checkpoint
+        tmp = path.with_suffix('.tmp')
+        tmp.write_bytes(raw)
+        os.replace(tmp, path)
+        st.session_state._checkpoint_bytes = raw
+    except OSError:
+        pass
+
+@st.cache_resource(show_spinner=False)
+def prune_checkpoints():
+    """Delete checkpoints untouched for CHECKPOINT_MAX_AGE; runs once per server process."""
+    cutoff = time.time() - CHECKPOINT_MAX_AGE
+    for path in CHECKPOINT_DIR.glob('*.json'):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            pass
+
+prune_checkpoints()
+
 # Initialize session state pathway_data
 if 'pathway_data' not in st.session_state:
-    st.session_state.pathway_data = {
+    st.session_state.pathway_data = load_checkpoint() or {
         'scope': {},
         'evidence': [],
         'logic': {},
@@ -123,10 +229,11 @@ if 'pathway_data' not in st.session_state:
     }
 
 # Conversational assistant state
+# Bounded so a long session can't grow the transcript without limit; the oldest messages roll off
 if 'assistant_messages' not in st.session_state:
-    st.session_state.assistant_messages = [
-        {'role': 'assistant', 'content': dialogue.get('intro')}
-    ]
+    st.session_state.assistant_messages = collections.deque(
+        [{'role': 'assistant', 'content': dialogue.get('intro')}], maxlen=MAX_CHAT_MESSAGES
+    )
 
 # Agent started flag (shows landing / starter page until user begins)
 if 'started' not in st.session_state:
@@ -179,17 +286,31 @@ def summarize_pathway():
 
     # If LLM available, ask it to rewrite/condense the summary
     if client:
-        prompt = (
-            "Please produce a concise, user-facing summary of the clinical pathway data below. "
-            "Keep it to 4-6 short bullet points and highlight any missing information.\n\n" + plaintext
-        )
-        llm_reply = ask_assistant(prompt, context='You are a concise clinical pathway assistant.')
+        try:
+            llm_reply = _llm_condense(plaintext, api_key_hash)
+        except RuntimeError:
+            llm_reply = None
         # If LLM returned something meaningful, prefer it
-        if llm_reply and not llm_reply.startswith('LLM error'):
+        if llm_reply:
             return llm_reply
 
     return plaintext
 
+@st.cache_data(persist="disk", max_entries=256, show_spinner=False)
+def _llm_condense(plaintext, key_hash):
+    """LLM rewrite of a plaintext summary; repeat requests for unchanged data skip the API call.
+
+    `key_hash` only scopes the cache entry to an API key. Raises on LLM errors so they aren't cached.
+    """
+    prompt = (
+        "Please produce a concise, user-facing summary of the clinical pathway data below. "
+        "Keep it to 4-6 short bullet points and highlight any missing information.\n\n" + plaintext
+    )
+    reply = ask_assistant(prompt, context='You are a concise clinical pathway assistant.')
+    if reply.startswith('LLM error'):
+        raise RuntimeError(reply)
+    return reply
+
 
 # ------------------- Conversational Phase Runner -------------------
 if 'current_phase' not in st.session_state:
@@ -198,28 +319,34 @@ if 'current_phase' not in st.session_state:
 def append_phase_message(msg):
     append_assistant_message('assistant', msg)
 
-def propose_structure_from_scope():
-    condition = st.session_state.pathway_data.get('scope', {}).get('condition','the condition')
-    return [
+@functools.lru_cache(maxsize=32)
+def propose_structure_from_scope(condition):
+    # Read-only and shared: st.cache_data would hand back a fresh unpickled copy on every call
+    return tuple(types.MappingProxyType(el) for el in (
         {"type": "Start Node", "name": f"Patient presents with {condition}"},
         {"type": "Decision Node", "name": "Risk Stratification / Severity Assessment"},
         {"type": "Note", "name": "Clinical Risk Score Details (e.g., Calculator)"},
         {"type": "Process Step", "name": "Initial Medical Management"},
         {"type": "End Node", "name": "Disposition (Admit vs. Discharge)"}
-    ]
+    ))
 
 def auto_run_phase_2():
     """Automatically search PubMed for proposed decision elements and save evidence."""
     data = st.session_state.pathway_data
     condition = data.get('scope', {}).get('condition', 'Clinical')
-    elements = propose_structure_from_scope()
+    elements = propose_structure_from_scope(data.get('scope', {}).get('condition', 'the condition'))
     evidence_bank = []
     append_phase_message(f"Running automated PubMed searches for {len(elements)} elements...")
-    for item in elements:
+    queries = [f"({condition}) AND ({item['name']}) AND (Guideline[pt] OR Systematic Review[pt])" for item in elements]
+    # Searches are independent, so issue them together instead of one after another
+    all_results = search_pubmed_many(queries, retmax=2)
+    for item, results in zip(elements, all_results):
         point = item['name']
-        query = f"({condition}) AND ({point}) AND (Guideline[pt] OR Systematic Review[pt])"
-        results = search_pubmed(query, retmax=2)
-        if results:
+        if results and results[0].startswith(PUBMED_ERROR):
+            # A failed search is not evidence; don't store or verify the error text
+            append_phase_message(f"PubMed search failed for '{point}' ({results[0]}), please add manual citation.")
+            evidence_bank.append({'point': point, 'citation': 'MANUAL_REQUIRED', 'verification': ''})
+        elif results:
             chosen = results[0]
             # Normalize to canonical evidence item
             evidence_bank.append({'point': point, 'citation': chosen, 'verification': 'Auto-imported'})
@@ -227,6 +354,13 @@ def auto_run_phase_2():
         else:
             append_phase_message(f"No API hits for '{point}', please add manual citation.")
             evidence_bank.append({'point': point, 'citation': 'MANUAL_REQUIRED', 'verification': ''})
+    if client:
+        to_verify = [e for e in evidence_bank if e['citation'] != 'MANUAL_REQUIRED']
+        if to_verify:
+            append_phase_message(f"Verifying {len(to_verify)} citations...")
+            verdicts = verify_evidence_batch([(e['citation'], e['point']) for e in to_verify])
+            for e, verdict in zip(to_verify, verdicts):
+                e['verification'] = verdict
     # Normalize evidence as a list of {'point','citation','verification'}
     data.setdefault('evidence', [])
     data['evidence'].extend(evidence_bank)
@@ -247,57 +381,172 @@ def auto_run_phase_3():
     st.session_state.pathway_data['mermaid'] = code
     append_phase_message('Mermaid flowchart generated from evidence nodes.')
 
+def auto_run_phases_2_and_3():
+    """Run phases 2 and 3 together, drafting the flowchart while the evidence search runs."""
+    data = st.session_state.pathway_data
+    condition = data.get('scope', {}).get('condition', 'the condition')
+    # Phase 3 only needs node names, which are known before any PubMed result comes back
+    points = [e.get('point') for e in data.get('evidence', []) if e.get('point')]
+    points += [item['name'] for item in propose_structure_from_scope(condition)]
+    nodes = list(dict.fromkeys(points))
+    entry = data.get('logic', {}).get('entry') or data.get('scope', {}).get('condition', 'Entry')
+    exit_pt = data.get('logic', {}).get('endpoints') or 'Disposition'
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        mermaid_future = pool.submit(generate_mermaid, entry, nodes, exit_pt)
+        run_phase(2)
+        code = mermaid_future.result()
+    append_phase_message(PHASE_INTROS[3])
+    st.session_state.pathway_data['mermaid'] = code
+    append_phase_message('Mermaid flowchart generated from evidence nodes.')
+    st.session_state.current_phase = 3
+
 def run_phase(phase):
-    if phase == 1:
-        # Use the conversational prompt from dialogue
-        append_phase_message(dialogue.get('phase_1_start'))
-    elif phase == 2:
-        append_phase_message(dialogue.get('phase_2_intro'))
+    if phase in PHASE_INTROS:
+        append_phase_message(PHASE_INTROS[phase])
+    if phase == 2:
         auto_run_phase_2()
     elif phase == 3:
-        append_phase_message(dialogue.get('phase_3_intro'))
         auto_run_phase_3()
-    elif phase == 4:
-        append_phase_message(dialogue.get('phase_4_intro'))
-    elif phase == 5:
-        append_phase_message(dialogue.get('phase_5_intro'))
 
 
+class _RateLimiter:
+    """Leaky-bucket throttle: hands out request slots at most `rate` per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+@st.cache_resource(show_spinner=False)
+def get_pubmed_limiter(rate):
+    # Shared across reruns and sessions so concurrent searches respect one NCBI budget
+    return _RateLimiter(rate)
+
+@st.cache_resource(show_spinner=False)
+def get_pubmed_session():
+    """Keep-alive HTTP session so esearch/esummary calls reuse one TLS connection to NCBI."""
+    session = requests.Session()
+    session.headers.update({'User-Agent': 'CarePathIQ/1.0'})
+    return session
+
+def _pubmed_get(url, attempts=3):
+    """Fetch an E-utilities URL under the NCBI rate limit, retrying 429/5xx with jittered backoff (or longer, if Retry-After says so)."""
+    # NCBI allows 3 requests/second, or 10 with an API key
+    limiter = get_pubmed_limiter(10 if os.environ.get('NCBI_API_KEY') else 3)
+    session = get_pubmed_session()
+    for attempt in range(attempts):
+        limiter.wait()
+        response = session.get(url, timeout=(3.0, 10.0))
+        retryable = response.status_code == 429 or response.status_code >= 500
+        if retryable and attempt < attempts - 1:
+            backoff = 2 ** attempt + random.random()
+            retry_after = response.headers.get('Retry-After', '')
+            time.sleep(max(min(float(retry_after), 60.0), backoff) if retry_after.isdigit() else backoff)
+            continue
+        response.raise_for_status()
+        # Both parsers accept bytes, so no intermediate decoded str is built
+        return orjson.loads(response.content) if orjson else json.loads(response.content)
+
+def _pubmed_url(endpoint, **params):
+    params['retmode'] = 'json'
+    ncbi_key = os.environ.get('NCBI_API_KEY')
+    if ncbi_key:
+        params['api_key'] = ncbi_key
+    return PUBMED_BASE_URL + endpoint + "?" + urllib.parse.urlencode(params)
+
+@st.cache_data(ttl=3600, max_entries=512, show_spinner=False)
+def _esearch(query, retmax):
+    """PubMed UIDs matching `query`. Raises on network/HTTP errors so failures are never cached."""
+    data = _pubmed_get(_pubmed_url("esearch.fcgi", db='pubmed', term=query, retmax=retmax))
+    return data.get('esearchresult', {}).get('idlist', [])
+
+_ITALIC_TAG = re.compile(r'&lt;/?i&gt;')  # escaped <i>/</i> markup in PubMed titles
+
+@st.cache_data(ttl=3600, max_entries=512, show_spinner=False)
+def _esummary(uids):
+    """Map each UID in the tuple `uids` to a formatted citation using a single esummary request."""
+    if not uids:
+        return {}
+    data = _pubmed_get(_pubmed_url("esummary.fcgi", db='pubmed', id=','.join(uids)))
+    result = data.get('result', {})
+    return {
+        uid: f"{(item.get('authors') or [{'name': 'Unknown'}])[0]['name']} et al. "
+             f"({item.get('pubdate', 'No Date')[:4]}). "
+             f"{_ITALIC_TAG.sub('', item.get('title', 'No Title'))}. {item.get('source', 'Journal')}."
+        for uid in uids if (item := result.get(uid))
+    }
+
+PUBMED_ERROR = 'Error fetching PubMed data'
+
+def _normalize_query(query):
+    # Collapse whitespace so trivially different queries share a cache entry.
+    # Case is kept: PubMed only treats upper-case AND/OR/NOT as operators.
+    return ' '.join(query.split())
+
 def search_pubmed(query, retmax=3):
-    base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
-    search_params = {'db': 'pubmed', 'term': query, 'retmode': 'json', 'retmax': retmax}
     try:
-        url = base_url + "esearch.fcgi?" + urllib.parse.urlencode(search_params)
-        with urllib.request.urlopen(url) as response:
-            data = json.loads(response.read().decode())
-            id_list = data.get('esearchresult', {}).get('idlist', [])
-        if not id_list:
-            return []
-        summary_params = {'db': 'pubmed', 'id': ','.join(id_list), 'retmode': 'json'}
-        url = base_url + "esummary.fcgi?" + urllib.parse.urlencode(summary_params)
-        with urllib.request.urlopen(url) as response:
-            data = json.loads(response.read().decode())
-            result = data.get('result', {})
-            citations = []
-            for uid in id_list:
-                if uid in result:
-                    item = result[uid]
-                    title = item.get('title', 'No Title').replace("&lt;i&gt;", "").replace("&lt;/i&gt;", "")
-                    authors = item.get('authors', [])
-                    first_author = authors[0]['name'] if authors else 'Unknown'
-                    pub_date = item.get('pubdate', 'No Date')[:4]
-                    source = item.get('source', 'Journal')
-                    citations.append(f"{first_author} et al. ({pub_date}). {title}. {source}.")
-            return citations
+        id_list = _esearch(_normalize_query(query), retmax)
+        summaries = _esummary(tuple(id_list))
+        return [summaries[uid] for uid in id_list if uid in summaries]
+    except Exception as e:
+        return [f"{PUBMED_ERROR}: {e}"]
+
+def search_pubmed_many(queries, retmax=3):
+    """Run several PubMed searches; returns one citation list per query, in order.
+
+    The esearch calls run concurrently and a single esummary covers every UID found.
+    """
+    if not queries:
+        return []
+
+    def _ids(query):
+        try:
+            return _esearch(_normalize_query(query), retmax)
+        except Exception as e:
+            return e
+
+    # More workers than NCBI's per-second budget would only queue on the rate limiter
+    workers = min(10 if os.environ.get('NCBI_API_KEY') else 3, len(queries))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        id_lists = list(pool.map(_ids, queries))
+    # Deduplicated union, preserving first-seen order
+    all_ids = tuple(dict.fromkeys(uid for ids in id_lists if isinstance(ids, list) for uid in ids))
+    summary_error = None
+    try:
+        summaries = _esummary(all_ids)
     except Exception as e:
-        return [f"Error fetching PubMed data: {e}"]
+        summaries, summary_error = {}, e
+
+    results = []
+    for ids in id_lists:
+        if isinstance(ids, Exception):
+            results.append([f"{PUBMED_ERROR}: {ids}"])
+        elif ids and summary_error:
+            results.append([f"{PUBMED_ERROR}: {summary_error}"])
+        else:
+            results.append([summaries[uid] for uid in ids if uid in summaries])
+    return results
 
-def ask_assistant(prompt, context=''):
+def ask_assistant(prompt, context='', max_tokens=512):
     if not client:
         return 'Analysis unavailable (No Key)'
     full = f"{context}\n\nTask: {prompt}"
     try:
-        stream = client.chat.completions.create(model='gpt-3.5-turbo', messages=[{'role':'user','content':full}], stream=False)
+        stream = client.chat.completions.create(
+            model=DEFAULT_MODEL,
+            messages=[{'role':'user','content':full}],
+            max_tokens=max_tokens,
+            temperature=0.2,
+            stream=False,
+        )
         # Depending on SDK, adapt:
         if hasattr(stream, 'choices'):
             return stream.choices[0].message.content
@@ -305,59 +554,173 @@ def ask_assistant(prompt, context=''):
     except Exception as e:
         return f'LLM error: {e}'
 
+def ask_assistant_stream(prompt, context=''):
+    """Like ask_assistant, but yields the reply in chunks as they arrive."""
+    if not client:
+        yield 'Analysis unavailable (No Key)'
+        return
+    full = f"{context}\n\nTask: {prompt}"
+    try:
+        stream = client.chat.completions.create(
+            model=DEFAULT_MODEL,
+            messages=[{'role':'user','content':full}],
+            max_tokens=512,
+            temperature=0.2,
+            stream=True,
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        yield f'LLM error: {e}'
+
+@st.cache_data(ttl=24*60*60, max_entries=1024, show_spinner=False)
+def _cached_verify(citation, node, key_hash):
+    """LLM verdict for one (citation, node) pair; re-verifying the same pair skips the API call.
+
+    `key_hash` only scopes the cache entry to an API key. Raises on LLM errors so they aren't cached.
+    """
+    # A verdict plus a one-line rationale; the cap stops the model from writing paragraphs
+    reply = ask_assistant(f"Does the citation '{citation}' support the decision '{node}'? Answer 'Verified' or 'Warning' with one-line rationale.", max_tokens=48)
+    if reply.startswith('LLM error'):
+        raise RuntimeError(reply)
+    return reply
+
+def verify_citation(citation, node):
+    if not client:
+        return 'Analysis unavailable (No Key)'
+    try:
+        return _cached_verify(citation, node, api_key_hash)
+    except RuntimeError as e:
+        return str(e)
+
+def verify_citations(pairs, max_workers=8):
+    """Verify (citation, node) pairs concurrently; returns verdicts in input order."""
+    if not pairs:
+        return []
+    # The OpenAI client is thread-safe, so workers share its connection pool
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(pairs))) as pool:
+        return list(pool.map(lambda pair: verify_citation(*pair), pairs))
+
+def verify_evidence_batch(pairs):
+    """Verify (citation, node) pairs with one LLM call; returns verdicts in input order.
+
+    Falls back to per-pair calls if the reply can't be matched up with the input.
+    """
+    if not pairs:
+        return []
+    if not client:
+        return ['Manual — no LLM'] * len(pairs)
+    items = '\n'.join(f"{i}) decision={node!r} citation={citation!r}" for i, (citation, node) in enumerate(pairs))
+    prompt = (
+        'For each numbered item, judge whether the citation supports the decision. '
+        'Return a JSON object {"results": [{"verdict": "Verified" or "Warning", "rationale": "one line"}, ...]} '
+        'with one entry per item, in order.\nItems:\n' + items
+    )
+    try:
+        resp = client.chat.completions.create(
+            model=DEFAULT_MODEL,
+            messages=[{'role':'user','content':prompt}],
+            max_tokens=48 * len(pairs) + 32,
+            temperature=0,
+            response_format={'type': 'json_object'},
+        )
+        results = json.loads(resp.choices[0].message.content)['results']
+        if len(results) != len(pairs):
+            raise ValueError('verdict count mismatch')
+        return [f"{r.get('verdict', 'Warning')}: {r['rationale']}" if r.get('rationale') else r.get('verdict', 'Warning')
+                for r in results]
+    except Exception:
+        return verify_citations(pairs)
+
+@st.cache_data(persist="disk", max_entries=256, show_spinner=False)
+def _cached_mermaid(entry, nodes, exit_point, key_hash):
+    """LLM-drafted flowchart for one (entry, nodes, exit) combination.
+
+    `key_hash` only scopes the cache entry to an API key. Raises on LLM errors so they aren't cached.
+    """
+    prompt = f"Create a Mermaid.js flowchart (graph TD) for Entry: {entry} Nodes: {list(nodes)} Exit: {exit_point}. Output only raw graph TD code."
+    reply = ask_assistant(prompt, context='You are a clinical pathway visual designer.')
+    if reply.startswith('LLM error'):
+        raise RuntimeError(reply)
+    return reply.replace('```mermaid','').replace('```','').strip()
+
 def generate_mermaid(entry, nodes, exit_point):
     if not client:
         return 'graph TD; A[No LLM]-->B[Manual]'
-    prompt = f"Create a Mermaid.js flowchart (graph TD) for Entry: {entry} Nodes: {nodes} Exit: {exit_point}. Output only raw graph TD code."
-    return ask_assistant(prompt, context='You are a clinical pathway visual designer.').replace('```mermaid','').replace('```','').strip()
+    try:
+        return _cached_mermaid(entry, tuple(nodes), exit_point, api_key_hash)
+    except RuntimeError as e:
+        return str(e)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _mermaid_html(code):
+    return _MERMAID_TEMPLATE.substitute(code=code, js_url=MERMAID_JS_URL)
+
+def render_mermaid(code):
+    components.html(_mermaid_html(code), height=500, scrolling=True)
+
+def compile_report_markdown(data):
+    """Build the Phase 5 Markdown report from `pathway_data`."""
+    scope = data.get('scope', {})
+    # Collect pieces and join once; repeated `+=` re-copies the report for every evidence row
+    parts = [
+        f"# Clinical Pathway: {scope.get('condition','Draft')}\n\n",
+        f"## 1. Project Charter\n{scope.get('problem','')}\n\n",
+        "## 2. Evidence Appraisal\n| Decision | Citation | Verification |\n|---|---|---|\n",
+    ]
+    parts.extend(f"| {e['point']} | {e['citation']} | {e['verification']} |\n" for e in data.get('evidence', []))
+    parts.append(f"\n## 3. Visual Logic\n```mermaid\n{data.get('mermaid','')}\n```\n")
+    parts.append(f"\n## 4. User Testing\n{data.get('testing',{})}\n")
+    return ''.join(parts)
 
 # Clinical Pathway Agent chat panel (placed after helper functions so dependencies exist)
+def _question(key, prompt):
+    # key_parts is the pathway_data path for the answer, split once here instead of on every reply
+    return types.MappingProxyType({'key': key, 'key_parts': tuple(key.split('.')), 'prompt': prompt})
+
+@functools.lru_cache(maxsize=8)
 def get_conversation_questions(phase: int):
+    """Question templates for a phase, built once; start_conversation copies them before use."""
     if phase == 1:
-        return [
-            {'key': 'scope.condition', 'prompt': 'What is the clinical condition? (e.g., Acute Chest Pain)'},
-            {'key': 'scope.population', 'prompt': 'Who is the target population? (e.g., Adults > 18 with chest pain)'},
-            {'key': 'scope.setting', 'prompt': 'What is the care setting? (e.g., Emergency Department)'},
-            {'key': 'scope.problem', 'prompt': 'Write a brief problem statement.'},
-            {'key': 'scope.objectives', 'prompt': 'List SMART objectives (one per line).'},
-        ]
+        return (
+            _question('scope.condition', 'What is the clinical condition? (e.g., Acute Chest Pain)'),
+            _question('scope.population', 'Who is the target population? (e.g., Adults > 18 with chest pain)'),
+            _question('scope.setting', 'What is the care setting? (e.g., Emergency Department)'),
+            _question('scope.problem', 'Write a brief problem statement.'),
+            _question('scope.objectives', 'List SMART objectives (one per line).'),
+        )
     if phase == 2:
-        return [
-            {'key': 'evidence.nodes', 'prompt': 'List key decision nodes or clinical questions (comma separated).'},
-        ]
+        return (
+            _question('evidence.nodes', 'List key decision nodes or clinical questions (comma separated).'),
+        )
     if phase == 3:
-        return [
-            {'key': 'logic.entry', 'prompt': 'What is the entry trigger (how does a patient enter the pathway)?'},
-            {'key': 'logic.endpoints', 'prompt': 'What are the possible exit/disposition endpoints?'},
-        ]
+        return (
+            _question('logic.entry', 'What is the entry trigger (how does a patient enter the pathway)?'),
+            _question('logic.endpoints', 'What are the possible exit/disposition endpoints?'),
+        )
     if phase == 4:
-        return [
-            {'key': 'testing.issues', 'prompt': 'Describe any heuristic or usability issues found.'},
-            {'key': 'testing.mitigation', 'prompt': 'Describe proposed mitigations.'},
-        ]
+        return (
+            _question('testing.issues', 'Describe any heuristic or usability issues found.'),
+            _question('testing.mitigation', 'Describe proposed mitigations.'),
+        )
     if phase == 5:
-        return [
-            {'key': 'operations.notes', 'prompt': 'Any final operational notes or implementation constraints?'},
-        ]
-    return []
+        return (
+            _question('operations.notes', 'Any final operational notes or implementation constraints?'),
+        )
+    return ()
 
 def start_conversation(phase: int):
     st.session_state.conversation = {
         'phase': phase,
-        'questions': get_conversation_questions(phase),
+        # Copied because handle_conversation_response may rewrite a prompt for this session
+        'questions': [dict(q) for q in get_conversation_questions(phase)],
         'index': 0,
         'active': True
     }
-    # For Phase 1, use the specific intro text requested
-    if phase == 1:
-        intro = dialogue.get('phase_1_start')
-    else:
-        intro = dialogue.get(f'phase_{phase}_intro') or 'Starting conversation for this phase.'
-    
-    append_assistant_message('assistant', intro)
+    append_assistant_message('assistant', PHASE_INTROS.get(phase, 'Starting conversation for this phase.'))
 
-def save_answer_to_pathway(key: str, answer: str):
-    parts = key.split('.')
+def save_answer_to_pathway(parts: tuple, answer: str):
     target = st.session_state.pathway_data
     for p in parts[:-1]:
         if p not in target or not isinstance(target[p], dict):
@@ -367,16 +730,17 @@ def save_answer_to_pathway(key: str, answer: str):
     # Special handling for lists
     if last == 'objectives':
         target[last] = [a.strip() for a in answer.splitlines() if a.strip()]
-    elif last in ('nodes', 'evidence_nodes') or key.startswith('evidence'):
+    elif last in ('nodes', 'evidence_nodes') or parts[0] == 'evidence':
         # Normalize evidence nodes into the canonical evidence list
         nodes = [a.strip() for a in answer.replace(';',',').split(',') if a.strip()]
         # Ensure top-level evidence is a list
-        st.session_state.pathway_data.setdefault('evidence', [])
+        evidence = st.session_state.pathway_data.setdefault('evidence', [])
+        # Avoid duplicating an existing point (or one repeated in this answer)
+        seen = {e.get('point') for e in evidence}
         for n in nodes:
-            # Avoid duplicating an existing point
-            exists = any(e.get('point') == n for e in st.session_state.pathway_data['evidence'])
-            if not exists:
-                st.session_state.pathway_data['evidence'].append({'point': n, 'citation': '', 'verification': ''})
+            if n not in seen:
+                seen.add(n)
+                evidence.append({'point': n, 'citation': '', 'verification': ''})
         # Also mirror into nested target if appropriate
         target[last] = nodes
     else:
@@ -388,7 +752,7 @@ def handle_conversation_response(response: str):
     if not conv or not conv.get('active'):
         return
     q = conv['questions'][conv['index']]
-    save_answer_to_pathway(q['key'], response)
+    save_answer_to_pathway(q['key_parts'], response)
     # Do NOT append "Saved: ..." message to keep chat clean
     
     conv['index'] += 1
@@ -399,10 +763,12 @@ def handle_conversation_response(response: str):
         # Clear history to show only the most recent question
         if len(st.session_state.assistant_messages) > 0:
             intro = st.session_state.assistant_messages[0]
-            st.session_state.assistant_messages = [intro]
+            st.session_state.assistant_messages.clear()
+            st.session_state.assistant_messages.append(intro)
         
-        # If LLM is active, generate a context-specific transition/prompt for the next question
-        if client:
+        # Optionally have the LLM write a context-specific transition; the static prompts stand on their own,
+        # so this extra round-trip per answer is off unless the user turns it on in the sidebar
+        if client and st.session_state.get('enable_dynamic_transitions', False):
             next_q = conv['questions'][conv['index']]
             # Construct a prompt for the LLM
             prompt_text = (
@@ -444,6 +810,140 @@ def handle_conversation_response(response: str):
         except Exception:
             pass
 
+def render_phase_tabs():
+    """The five phase tabs; shown directly in demo mode and inside an expander when an LLM is connected."""
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["1. Scope & Charter","2. Evidence Appraisal","3. Logic & Visuals","4. User Testing","5. Final Report"])
+
+    with tab1:
+        st.header("Phase 1 — Scope & Charter")
+        with st.form('scope_form'):
+            cond = st.text_input('Clinical Condition', value=st.session_state.pathway_data['scope'].get('condition',''))
+            pop = st.text_input('Target Population', value=st.session_state.pathway_data['scope'].get('population',''))
+            setting = st.text_input('Care Setting', value=st.session_state.pathway_data['scope'].get('setting',''))
+            problem = st.text_area('Problem Statement', value=st.session_state.pathway_data['scope'].get('problem',''))
+            objectives = st.text_area('SMART Objectives', value='\n'.join(st.session_state.pathway_data['scope'].get('objectives',[])))
+            if st.form_submit_button('Save Charter', key='save_charter'):
+                st.session_state.pathway_data['scope'] = {'condition':cond,'population':pop,'setting':setting,'problem':problem,'objectives':[o for o in objectives.split('\n') if o.strip()]}
+                st.success('Scope saved')
+            # Phase controls
+            if st.form_submit_button('Auto-run Phase 1 (Guidance)', key='auto_run_phase1'):
+                run_phase(1)
+            if st.form_submit_button('Get guidance (Clinical Pathway Agent)', key='get_guidance_phase1'):
+                start_conversation(1)
+            if st.form_submit_button('Next: Go to Phase 2', key='next_phase1'):
+                st.session_state.current_phase = 2
+                run_phase(2)
+
+    with tab2:
+        st.header('Phase 2 — Rapid Evidence Appraisal')
+        node = st.text_input('Decision Node / Clinical Question')
+        if st.button('Search PubMed & Verify', key='search_pubmed_verify') and node:
+            condition = st.session_state.pathway_data['scope'].get('condition','Clinical')
+            query = f"({condition}) AND ({node}) AND (Guideline[pt] OR Systematic Review[pt])"
+            cites = search_pubmed(query)
+            if cites and cites[0].startswith(PUBMED_ERROR):
+                st.error(f"{cites[0]} — try again or enter the citation manually")
+            elif cites:
+                st.write('Top results:')
+                for i,c in enumerate(cites,1):
+                    st.write(f"{i}. {c}")
+                sel = st.number_input('Select # to use as citation (0 to enter manual)', min_value=0, max_value=len(cites), value=1)
+                if sel==0:
+                    citation = st.text_input('Manual citation')
+                else:
+                    citation = cites[int(sel)-1]
+                verification = verify_citation(citation, node) if client else 'Manual — no LLM'
+                entry = {'point':node,'citation':citation,'verification':verification}
+                st.session_state.pathway_data['evidence'].append(entry)
+                st.success('Evidence saved')
+            else:
+                st.warning('No citations found — try manual entry')
+
+        # Phase controls
+        if st.button('Auto-run Phase 2 (Automated Evidence Search)', key='auto_run_phase2'):
+            run_phase(2)
+        if st.button('Auto-run Phases 2→3 (Evidence + Flowchart)', key='auto_run_phases_2_3'):
+            auto_run_phases_2_and_3()
+        if st.button('Get guidance (Clinical Pathway Agent)', key='get_guidance_phase2'):
+            start_conversation(2)
+        if st.button('Next: Go to Phase 3', key='next_phase2'):
+            st.session_state.current_phase = 3
+            run_phase(3)
+
+        pending = [e for e in st.session_state.pathway_data['evidence']
+                   if e.get('citation') not in ('', 'MANUAL_REQUIRED') and not e.get('verification')]
+        if client and pending and st.button(f'Verify All Pending ({len(pending)})', key='verify_all_pending'):
+            for e, verdict in zip(pending, verify_evidence_batch([(e['citation'], e['point']) for e in pending])):
+                e['verification'] = verdict
+            st.success(f'Verified {len(pending)} citations')
+
+        if st.session_state.pathway_data['evidence']:
+            st.markdown('### Evidence Bank')
+            for i,e in enumerate(st.session_state.pathway_data['evidence']):
+                with st.expander(f"{i+1}. {e['point']}"):
+                    st.write(f"**Citation:** {e['citation']}")
+                    st.info(f"**Verification:** {e['verification']}")
+
+    with tab3:
+        st.header('Phase 3 — Logic & Visuals')
+        # One form so editing both fields costs a single rerun, on submit
+        with st.form('logic_form'):
+            col1,col2 = st.columns(2)
+            entry_pt = col1.text_input('Entry Trigger', value=st.session_state.pathway_data['logic'].get('entry','Triage'))
+            exit_pt = col2.text_input('Exit/Disposition', value=st.session_state.pathway_data['logic'].get('endpoints','Disposition'))
+            if st.form_submit_button('Generate Flowchart', key='generate_flowchart'):
+                nodes = [e['point'] for e in st.session_state.pathway_data['evidence']]
+                if not nodes:
+                    st.error('Add evidence nodes first (Tab 2)')
+                else:
+                    code = generate_mermaid(entry_pt, nodes, exit_pt)
+                    st.session_state.pathway_data['mermaid'] = code
+                    st.session_state.pathway_data['logic'] = {'entry':entry_pt,'endpoints':exit_pt,'nodes':nodes}
+                    st.success('Mermaid generated')
+
+        # Phase controls
+        if st.button('Auto-run Phase 3 (Generate from Evidence)', key='auto_run_phase3'):
+            run_phase(3)
+        if st.button('Get guidance (Clinical Pathway Agent)', key='get_guidance_phase3'):
+            start_conversation(3)
+        if st.button('Next: Go to Phase 4', key='next_phase3'):
+            st.session_state.current_phase = 4
+            run_phase(4)
+
+        if st.session_state.pathway_data.get('mermaid'):
+            st.write('### Interactive Flowchart')
+            render_mermaid(st.session_state.pathway_data['mermaid'])
+
+    with tab4:
+        st.header('Phase 4 — User Testing')
+        with st.form('testing_form'):
+            heur = st.text_area('Heuristic Issues Found', value=st.session_state.pathway_data['testing'].get('issues',''))
+            mitig = st.text_area('Mitigation Plan', value=st.session_state.pathway_data['testing'].get('mitigation',''))
+            if st.form_submit_button('Save Testing', key='save_testing'):
+                st.session_state.pathway_data['testing'] = {'issues':heur,'mitigation':mitig,'status':'Saved'}
+                st.success('Testing feedback saved')
+
+        # Phase controls
+        if st.button('Auto-run Phase 4 (Testing Guidance)', key='auto_run_phase4'):
+            run_phase(4)
+        if st.button('Get guidance (Clinical Pathway Agent)', key='get_guidance_phase4'):
+            start_conversation(4)
+        if st.button('Next: Go to Phase 5', key='next_phase4'):
+            st.session_state.current_phase = 5
+            run_phase(5)
+
+    with tab5:
+        st.header('Phase 5 — Final Report')
+        if st.button('Compile Final Report', key='compile_final_report'):
+            md = compile_report_markdown(st.session_state.pathway_data)
+            st.markdown('### Preview')
+            st.markdown(md)
+            st.download_button('Download Report (MD)', data=md, file_name='clinical_pathway.md', mime='text/markdown')
+        if st.button('Auto-run Phase 5 (Compile & Summary)', key='auto_run_phase5'):
+            run_phase(5)
+        if st.button('Get guidance (Clinical Pathway Agent)', key='get_guidance_phase5'):
+            start_conversation(5)
+
 # Landing / starter page: require API key then show onboarding instructions
 if not st.session_state.started:
     if not openai_api_key:
@@ -470,8 +970,14 @@ if not st.session_state.started:
 
 if st.session_state.started:
     with st.expander('Clinical Pathway Agent — conversational help', expanded=True):
-        # Render conversation history using Streamlit's chat components
-        for msg in st.session_state.assistant_messages:
+        # Render conversation history using Streamlit's chat components.
+        # Every rerun redraws the transcript, so only the most recent messages are drawn unless asked.
+        history = st.session_state.assistant_messages
+        earlier = max(len(history) - CHAT_HISTORY_WINDOW, 0)
+        shown = itertools.islice(history, earlier, None)
+        if earlier and st.toggle(f'Show {earlier} earlier messages', key='show_earlier_messages'):
+            shown = history
+        for msg in shown:
             role = msg.get('role', 'assistant')
             content = msg.get('content', '')
             if role == 'assistant':
@@ -514,297 +1020,39 @@ if st.session_state.started:
                         summary = f'Error generating summary: {e}'
                     append_assistant_message('assistant', summary)
                 else:
-                    reply = ask_assistant(user_input)
+                    # Stream so the first tokens show immediately instead of after the full completion
+                    with st.chat_message('user'):
+                        st.write(user_input)
+                    with st.chat_message('assistant'):
+                        reply = st.write_stream(ask_assistant_stream(user_input))
                     append_assistant_message('assistant', reply)
 
         # --- UI Tabs ---
         # If LLM is active, hide the structured tabs by default to focus on conversation
-        show_tabs = True
         if client:
-            show_tabs = False
             with st.expander("View Structured Data & Controls", expanded=False):
                 st.info("Structured fields are hidden in LLM mode to focus on the conversation. Expand to view or edit manually.")
-                tab1, tab2, tab3, tab4, tab5 = st.tabs(["1. Scope & Charter","2. Evidence Appraisal","3. Logic & Visuals","4. User Testing","5. Final Report"])
-                
-                with tab1:
-                    st.header("Phase 1 — Scope & Charter")
-                    with st.form('scope_form'):
-                        cond = st.text_input('Clinical Condition', value=st.session_state.pathway_data['scope'].get('condition',''))
-                        pop = st.text_input('Target Population', value=st.session_state.pathway_data['scope'].get('population',''))
-                        setting = st.text_input('Care Setting', value=st.session_state.pathway_data['scope'].get('setting',''))
-                        problem = st.text_area('Problem Statement', value=st.session_state.pathway_data['scope'].get('problem',''))
-                        objectives = st.text_area('SMART Objectives', value='\n'.join(st.session_state.pathway_data['scope'].get('objectives',[])))
-                        if st.form_submit_button('Save Charter', key='save_charter'):
-                            st.session_state.pathway_data['scope'] = {'condition':cond,'population':pop,'setting':setting,'problem':problem,'objectives':[o for o in objectives.split('\n') if o.strip()]}
-                            st.success('Scope saved')
-                        # Phase controls
-                        if st.form_submit_button('Auto-run Phase 1 (Guidance)', key='auto_run_phase1'):
-                            run_phase(1)
-                        if st.form_submit_button('Get guidance (Clinical Pathway Agent)', key='get_guidance_phase1'):
-                            start_conversation(1)
-                        if st.form_submit_button('Next: Go to Phase 2', key='next_phase1'):
-                            st.session_state.current_phase = 2
-                            run_phase(2)
-
-                with tab2:
-                    st.header('Phase 2 — Rapid Evidence Appraisal')
-                    node = st.text_input('Decision Node / Clinical Question')
-                    if st.button('Search PubMed & Verify', key='search_pubmed_verify') and node:
-                        condition = st.session_state.pathway_data['scope'].get('condition','Clinical')
-                        query = f"({condition}) AND ({node}) AND (Guideline[pt] OR Systematic Review[pt])"
-                        cites = search_pubmed(query)
-                        if cites:
-                            st.write('Top results:')
-                            for i,c in enumerate(cites,1):
-                                st.write(f"{i}. {c}")
-                            sel = st.number_input('Select # to use as citation (0 to enter manual)', min_value=0, max_value=len(cites), value=1)
-                            if sel==0:
-                                citation = st.text_input('Manual citation')
-                            else:
-                                citation = cites[int(sel)-1]
-                            verification = ask_assistant(f"Does the citation '{citation}' support the decision '{node}'? Answer 'Verified' or 'Warning' with one-line rationale.") if client else 'Manual — no LLM'
-                            entry = {'point':node,'citation':citation,'verification':verification}
-                            st.session_state.pathway_data['evidence'].append(entry)
-                            st.success('Evidence saved')
-                        else:
-                            st.warning('No citations found — try manual entry')
-
-                    # Phase controls
-                    if st.button('Auto-run Phase 2 (Automated Evidence Search)', key='auto_run_phase2'):
-                        run_phase(2)
-                    if st.button('Get guidance (Clinical Pathway Agent)', key='get_guidance_phase2'):
-                        start_conversation(2)
-                    if st.button('Next: Go to Phase 3', key='next_phase2'):
-                        st.session_state.current_phase = 3
-                        run_phase(3)
-
-                    if st.session_state.pathway_data['evidence']:
-                        st.markdown('### Evidence Bank')
-                        for i,e in enumerate(st.session_state.pathway_data['evidence']):
-                            with st.expander(f"{i+1}. {e['point']}"):
-                                st.write(f"**Citation:** {e['citation']}")
-                                st.info(f"**Verification:** {e['verification']}")
-
-                with tab3:
-                    st.header('Phase 3 — Logic & Visuals')
-                    col1,col2 = st.columns(2)
-                    entry_pt = col1.text_input('Entry Trigger', value=st.session_state.pathway_data['logic'].get('entry','Triage'))
-                    exit_pt = col2.text_input('Exit/Disposition', value=st.session_state.pathway_data['logic'].get('endpoints','Disposition'))
-                    if st.button('Generate Flowchart', key='generate_flowchart'):
-                        nodes = [e['point'] for e in st.session_state.pathway_data['evidence']]
-                        if not nodes:
-                            st.error('Add evidence nodes first (Tab 2)')
-                        else:
-                            code = generate_mermaid(entry_pt, nodes, exit_pt)
-                            st.session_state.pathway_data['mermaid'] = code
-                            st.session_state.pathway_data['logic'] = {'entry':entry_pt,'endpoints':exit_pt,'nodes':nodes}
-                            st.success('Mermaid generated')
-
-                    # Phase controls
-                    if st.button('Auto-run Phase 3 (Generate from Evidence)', key='auto_run_phase3'):
-                        run_phase(3)
-                    if st.button('Get guidance (Clinical Pathway Agent)', key='get_guidance_phase3'):
-                        start_conversation(3)
-                    if st.button('Next: Go to Phase 4', key='next_phase3'):
-                        st.session_state.current_phase = 4
-                        run_phase(4)
-
-                    if st.session_state.pathway_data.get('mermaid'):
-                        mermaid_html = f"""
-                        <script type="module">
-                            import mermaid from 'https://cdn.jsdelivr.net/npm/mermaid@10/dist/mermaid.esm.min.mjs';
-                            mermaid.initialize({{ startOnLoad: true }});
-                        </script>
-                        <div class="mermaid">{st.session_state.pathway_data['mermaid']}</div>
-                        """
-                        st.write('### Interactive Flowchart')
-                        components.html(mermaid_html, height=500, scrolling=True)
-
-                with tab4:
-                    st.header('Phase 4 — User Testing')
-                    heur = st.text_area('Heuristic Issues Found', value=st.session_state.pathway_data['testing'].get('issues',''))
-                    mitig = st.text_area('Mitigation Plan', value=st.session_state.pathway_data['testing'].get('mitigation',''))
-                    if st.button('Save Testing', key='save_testing'):
-                        st.session_state.pathway_data['testing'] = {'issues':heur,'mitigation':mitig,'status':'Saved'}
-                        st.success('Testing feedback saved')
-
-                    # Phase controls
-                    if st.button('Auto-run Phase 4 (Testing Guidance)', key='auto_run_phase4'):
-                        run_phase(4)
-                    if st.button('Get guidance (Clinical Pathway Agent)', key='get_guidance_phase4'):
-                        start_conversation(4)
-                    if st.button('Next: Go to Phase 5', key='next_phase4'):
-                        st.session_state.current_phase = 5
-                        run_phase(5)
-
-                with tab5:
-                    st.header('Phase 5 — Final Report')
-                    if st.button('Compile Final Report', key='compile_final_report'):
-                        data = st.session_state.pathway_data
-                        scope = data.get('scope',{})
-                        md = f"# Clinical Pathway: {scope.get('condition','Draft')}\n\n"
-                        md += f"## 1. Project Charter\n{scope.get('problem','')}\n\n"
-                        md += "## 2. Evidence Appraisal\n| Decision | Citation | Verification |\n|---|---|---|\n"
-                        for e in data.get('evidence',[]):
-                            md += f"| {e['point']} | {e['citation']} | {e['verification']} |\n"
-                        md += f"\n## 3. Visual Logic\n```mermaid\n{data.get('mermaid','')}\n```\n"
-                        md += f"\n## 4. User Testing\n{data.get('testing',{})}\n"
-                        st.markdown('### Preview')
-                        st.markdown(md)
-                        st.download_button('Download Report (MD)', data=md, file_name='clinical_pathway.md', mime='text/markdown')
-                    if st.button('Auto-run Phase 5 (Compile & Summary)', key='auto_run_phase5'):
-                        run_phase(5)
-                    if st.button('Get guidance (Clinical Pathway Agent)', key='get_guidance_phase5'):
-                        start_conversation(5)
+                render_phase_tabs()
         else:
             # Standard view for Demo Mode
-            tab1, tab2, tab3, tab4, tab5 = st.tabs(["1. Scope & Charter","2. Evidence Appraisal","3. Logic & Visuals","4. User Testing","5. Final Report"])
-
-            with tab1:
-                st.header("Phase 1 — Scope & Charter")
-                with st.form('scope_form'):
-                    cond = st.text_input('Clinical Condition', value=st.session_state.pathway_data['scope'].get('condition',''))
-                    pop = st.text_input('Target Population', value=st.session_state.pathway_data['scope'].get('population',''))
-                    setting = st.text_input('Care Setting', value=st.session_state.pathway_data['scope'].get('setting',''))
-                    problem = st.text_area('Problem Statement', value=st.session_state.pathway_data['scope'].get('problem',''))
-                    objectives = st.text_area('SMART Objectives', value='\n'.join(st.session_state.pathway_data['scope'].get('objectives',[])))
-                    if st.form_submit_button('Save Charter', key='save_charter'):
-                        st.session_state.pathway_data['scope'] = {'condition':cond,'population':pop,'setting':setting,'problem':problem,'objectives':[o for o in objectives.split('\n') if o.strip()]}
-                        st.success('Scope saved')
-                    # Phase controls
-                    if st.form_submit_button('Auto-run Phase 1 (Guidance)', key='auto_run_phase1'):
-                        run_phase(1)
-                    if st.form_submit_button('Get guidance (Clinical Pathway Agent)', key='get_guidance_phase1'):
-                        start_conversation(1)
-                    if st.form_submit_button('Next: Go to Phase 2', key='next_phase1'):
-                        st.session_state.current_phase = 2
-                        run_phase(2)
-
-            with tab2:
-                st.header('Phase 2 — Rapid Evidence Appraisal')
-                node = st.text_input('Decision Node / Clinical Question')
-                if st.button('Search PubMed & Verify', key='search_pubmed_verify') and node:
-                    condition = st.session_state.pathway_data['scope'].get('condition','Clinical')
-                    query = f"({condition}) AND ({node}) AND (Guideline[pt] OR Systematic Review[pt])"
-                    cites = search_pubmed(query)
-                    if cites:
-                        st.write('Top results:')
-                        for i,c in enumerate(cites,1):
-                            st.write(f"{i}. {c}")
-                        sel = st.number_input('Select # to use as citation (0 to enter manual)', min_value=0, max_value=len(cites), value=1)
-                        if sel==0:
-                            citation = st.text_input('Manual citation')
-                        else:
-                            citation = cites[int(sel)-1]
-                        verification = ask_assistant(f"Does the citation '{citation}' support the decision '{node}'? Answer 'Verified' or 'Warning' with one-line rationale.") if client else 'Manual — no LLM'
-                        entry = {'point':node,'citation':citation,'verification':verification}
-                        st.session_state.pathway_data['evidence'].append(entry)
-                        st.success('Evidence saved')
-                    else:
-                        st.warning('No citations found — try manual entry')
-
-                # Phase controls
-                if st.button('Auto-run Phase 2 (Automated Evidence Search)', key='auto_run_phase2'):
-                    run_phase(2)
-                if st.button('Get guidance (Clinical Pathway Agent)', key='get_guidance_phase2'):
-                    start_conversation(2)
-                if st.button('Next: Go to Phase 3', key='next_phase2'):
-                    st.session_state.current_phase = 3
-                    run_phase(3)
-
-                if st.session_state.pathway_data['evidence']:
-                    st.markdown('### Evidence Bank')
-                    for i,e in enumerate(st.session_state.pathway_data['evidence']):
-                        with st.expander(f"{i+1}. {e['point']}"):
-                            st.write(f"**Citation:** {e['citation']}")
-                            st.info(f"**Verification:** {e['verification']}")
-
-            with tab3:
-                st.header('Phase 3 — Logic & Visuals')
-                col1,col2 = st.columns(2)
-                entry_pt = col1.text_input('Entry Trigger', value=st.session_state.pathway_data['logic'].get('entry','Triage'))
-                exit_pt = col2.text_input('Exit/Disposition', value=st.session_state.pathway_data['logic'].get('endpoints','Disposition'))
-                if st.button('Generate Flowchart', key='generate_flowchart'):
-                    nodes = [e['point'] for e in st.session_state.pathway_data['evidence']]
-                    if not nodes:
-                        st.error('Add evidence nodes first (Tab 2)')
-                    else:
-                        code = generate_mermaid(entry_pt, nodes, exit_pt)
-                        st.session_state.pathway_data['mermaid'] = code
-                        st.session_state.pathway_data['logic'] = {'entry':entry_pt,'endpoints':exit_pt,'nodes':nodes}
-                        st.success('Mermaid generated')
-
-                # Phase controls
-                if st.button('Auto-run Phase 3 (Generate from Evidence)', key='auto_run_phase3'):
-                    run_phase(3)
-                if st.button('Get guidance (Clinical Pathway Agent)', key='get_guidance_phase3'):
-                    start_conversation(3)
-                if st.button('Next: Go to Phase 4', key='next_phase3'):
-                    st.session_state.current_phase = 4
-                    run_phase(4)
-
-                if st.session_state.pathway_data.get('mermaid'):
-                    mermaid_html = f"""
-                    <script type="module">
-                        import mermaid from 'https://cdn.jsdelivr.net/npm/mermaid@10/dist/mermaid.esm.min.mjs';
-                        mermaid.initialize({{ startOnLoad: true }});
-                    </script>
-                    <div class="mermaid">{st.session_state.pathway_data['mermaid']}</div>
-                    """
-                    st.write('### Interactive Flowchart')
-                    components.html(mermaid_html, height=500, scrolling=True)
-
-            with tab4:
-                st.header('Phase 4 — User Testing')
-                heur = st.text_area('Heuristic Issues Found', value=st.session_state.pathway_data['testing'].get('issues',''))
-                mitig = st.text_area('Mitigation Plan', value=st.session_state.pathway_data['testing'].get('mitigation',''))
-                if st.button('Save Testing', key='save_testing'):
-                    st.session_state.pathway_data['testing'] = {'issues':heur,'mitigation':mitig,'status':'Saved'}
-                    st.success('Testing feedback saved')
-
-                # Phase controls
-                if st.button('Auto-run Phase 4 (Testing Guidance)', key='auto_run_phase4'):
-                    run_phase(4)
-                if st.button('Get guidance (Clinical Pathway Agent)', key='get_guidance_phase4'):
-                    start_conversation(4)
-                if st.button('Next: Go to Phase 5', key='next_phase4'):
-                    st.session_state.current_phase = 5
-                    run_phase(5)
-
-            with tab5:
-                st.header('Phase 5 — Final Report')
-                if st.button('Compile Final Report', key='compile_final_report'):
-                    data = st.session_state.pathway_data
-                    scope = data.get('scope',{})
-                    md = f"# Clinical Pathway: {scope.get('condition','Draft')}\n\n"
-                    md += f"## 1. Project Charter\n{scope.get('problem','')}\n\n"
-                    md += "## 2. Evidence Appraisal\n| Decision | Citation | Verification |\n|---|---|---|\n"
-                    for e in data.get('evidence',[]):
-                        md += f"| {e['point']} | {e['citation']} | {e['verification']} |\n"
-                    md += f"\n## 3. Visual Logic\n```mermaid\n{data.get('mermaid','')}\n```\n"
-                    md += f"\n## 4. User Testing\n{data.get('testing',{})}\n"
-                    st.markdown('### Preview')
-                    st.markdown(md)
-                    st.download_button('Download Report (MD)', data=md, file_name='clinical_pathway.md', mime='text/markdown')
-                if st.button('Auto-run Phase 5 (Compile & Summary)', key='auto_run_phase5'):
-                    run_phase(5)
-                if st.button('Get guidance (Clinical Pathway Agent)', key='get_guidance_phase5'):
-                    start_conversation(5)
+            render_phase_tabs()
 
 st.sidebar.markdown('---')
 st.sidebar.write('CarePathIQ — minimal Streamlit implementation')
 
 # Debug: allow loading demo Phase 1 data into session state
-def load_demo_data():
-    import json
-    from pathlib import Path
-    demo_path = Path('demo_phase1_saved.json')
-    if demo_path.exists():
-        try:
-            data = json.loads(demo_path.read_text())
-        except Exception:
-            data = None
-    else:
+DEMO_PATH = Path('demo_phase1_saved.json')
+
+@st.cache_data(show_spinner=False)
+def _load_demo_json(mtime):
+    """Parsed demo file; `mtime` is only the cache key, so editing the file reloads it."""
+    return json.loads(DEMO_PATH.read_text())
+
+def demo_pathway_data():
+    """Demo Phase 1 data from `demo_phase1_saved.json`, or the built-in chest pain example."""
+    try:
+        data = _load_demo_json(DEMO_PATH.stat().st_mtime)
+    except (OSError, ValueError):
         data = None
     if not data:
         data = {
@@ -825,7 +1073,10 @@ def load_demo_data():
             'operations': {},
             'mermaid': ''
         }
-    st.session_state.pathway_data = data
+    return data
+
+def load_demo_data():
+    st.session_state.pathway_data = demo_pathway_data()
     append_assistant_message('assistant', 'Demo Phase 1 data loaded into session state.')
     st.sidebar.success('Demo data loaded')
 
@@ -833,8 +1084,11 @@ if st.sidebar.button('Load demo Phase 1 data', key='load_demo_data'):
     load_demo_data()
 
 # Detailed checklist UI in the sidebar
-if 'checklist_overrides' not in st.session_state:
-    st.session_state.checklist_overrides = {}
+# Manual overrides packed into ints: bit i of the mask marks check i as overridden,
+# and the same bit of the values int holds the user's choice
+if 'checklist_override_mask' not in st.session_state:
+    st.session_state.checklist_override_mask = 0
+    st.session_state.checklist_override_values = 0
 
 def get_default_checks():
     data = st.session_state.pathway_data
@@ -849,83 +1103,73 @@ def get_default_checks():
         bool(data.get('mermaid','').strip()),
     ]
 
-check_labels = [
+check_labels = (
     'Scope — Condition defined',
     'Scope — Problem statement written',
     'Scope — SMART objectives documented',
     'Evidence — At least one citation added',
     'Logic — Decision nodes defined',
     'Visuals — Mermaid flowchart generated',
-]
-
-defaults = get_default_checks()
-checked_count = 0
-checkbox_keys = []
-st.sidebar.markdown('**Progress Checklist**')
-for i,label in enumerate(check_labels, start=1):
-    key = f'check_{i}'
-    checkbox_keys.append(key)
-    default = st.session_state.checklist_overrides.get(key, defaults[i-1])
-    val = st.sidebar.checkbox(label, value=default, key=key)
-    # Store overrides when the user changes a checkbox
-    if val != defaults[i-1]:
-        st.session_state.checklist_overrides[key] = val
+)
+
+def _update_check_override(key, bit, default):
+    # Runs only when the user toggles a checkbox, instead of diffing every box on every rerun
+    val = st.session_state[key]
+    if val != default:
+        st.session_state.checklist_override_mask |= bit
+        if val:
+            st.session_state.checklist_override_values |= bit
+        else:
+            st.session_state.checklist_override_values &= ~bit
     else:
-        # remove override if it matches default
-        st.session_state.checklist_overrides.pop(key, None)
-    if val:
-        checked_count += 1
-
-total_checks = len(check_labels)
-percent = int((checked_count / total_checks) * 100) if total_checks else 0
-st.sidebar.metric('Progress', f'{percent}%')
-st.sidebar.progress(percent)
-st.sidebar.write(f'{checked_count}/{total_checks} sections complete')
+        st.session_state.checklist_override_mask &= ~bit
+
+@st.fragment
+def render_checklist():
+    """Sidebar progress checklist; toggling a box reruns only this fragment, not the whole app."""
+    defaults = get_default_checks()
+    mask = st.session_state.checklist_override_mask
+    values = st.session_state.checklist_override_values
+    checked = []
+    st.markdown('**Progress Checklist**')
+    for i,label in enumerate(check_labels, start=1):
+        key = f'check_{i}'
+        bit = 1 << (i - 1)
+        default = bool(values & bit) if mask & bit else defaults[i-1]
+        checked.append(st.checkbox(label, value=default, key=key, on_change=_update_check_override, args=(key, bit, defaults[i-1])))
+    checked_count = sum(checked)
+
+    total_checks = len(check_labels)
+    percent = int((checked_count / total_checks) * 100) if total_checks else 0
+    st.metric('Progress', f'{percent}%')
+    st.progress(percent)
+    st.write(f'{checked_count}/{total_checks} sections complete')
+
+with st.sidebar:
+    render_checklist()
 
 # Debug helper: programmatic demo loader and snapshot writer
 def _load_demo_and_snapshot():
-    import json
-    from pathlib import Path
-    demo_path = Path('demo_phase1_saved.json')
-    if demo_path.exists():
-        try:
-            data = json.loads(demo_path.read_text())
-        except Exception:
-            data = None
-    else:
-        data = None
-    if not data:
-        data = {
-            'scope': {
-                'condition': 'Acute Chest Pain',
-                'population': 'Adults >=18 years presenting to ED with chest pain',
-                'setting': 'Emergency Department',
-                'problem': 'Need a clear, evidence-based pathway to risk-stratify chest pain and reduce unnecessary admissions.',
-                'objectives': [
-                    'Reduce time to risk stratification to <30 minutes',
-                    'Ensure ≥90% of high-risk patients receive cardiology consult',
-                    'Decrease unnecessary admissions for low-risk patients by 20%'
-                ]
-            },
-            'evidence': [],
-            'logic': {},
-            'testing': {},
-            'operations': {},
-            'mermaid': ''
-        }
-    st.session_state.pathway_data = data
+    st.session_state.pathway_data = demo_pathway_data()
     st.session_state.started = True
     append_assistant_message('assistant', 'Demo Phase 1 data auto-loaded into session state (debug).')
     # write snapshot to workspace so the agent can read it
+    data = st.session_state.pathway_data
+    snapshot = orjson.dumps(data, option=orjson.OPT_INDENT_2) if orjson else json.dumps(data, indent=2).encode()
     try:
-        Path('session_snapshot.json').write_text(json.dumps(st.session_state.pathway_data, indent=2))
+        Path('session_snapshot.json').write_bytes(snapshot)
     except Exception:
         pass
 
-# If a trigger file exists, auto-load demo on next session run
-from pathlib import Path
-if Path('.auto_load_demo').exists():
-    try:
-        _load_demo_and_snapshot()
-    except Exception:
-        pass
+# If a trigger file exists, auto-load demo on next session run.
+# Checked once per session: later reruns neither stat the file nor reload over the user's edits.
+if not st.session_state.get('_auto_load_checked'):
+    st.session_state._auto_load_checked = True
+    if Path('.auto_load_demo').exists():
+        try:
+            _load_demo_and_snapshot()
+        except Exception:
+            pass
+
+# Persist whatever this run changed
+save_checkpoint()
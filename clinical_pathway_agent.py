@@ -1,14 +1,210 @@
+import argparse
+import atexit
+import getpass
 import time
 import sys
 import os
-import urllib.request
+import http.client
 import urllib.parse
 import json
-from openai import OpenAI
+import random
+import types
+import re
+import html
+import hashlib
+import sqlite3
+import threading
+import zlib
+import gzip
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+import dataclasses
+from dataclasses import dataclass, field
+
+try:
+    import orjson
+except ImportError:  # optional: faster JSON decoding for PubMed responses
+    orjson = None
+
+try:
+    import readline
+except ImportError:  # optional: line editing, history and tab completion (not available on Windows)
+    readline = None
+
+# E-utilities request prefixes; only the term/id part varies per call.
+NCBI_API_KEY = os.environ.get("NCBI_API_KEY", "")
+# NCBI asks clients to identify themselves with a contact address (tool/email params and User-Agent)
+CONTACT_EMAIL = os.environ.get("CPA_CONTACT", "example@example.com")
+_EUTILS_HEADERS = {"User-Agent": f"CarePathIQ/1.0 (mailto:{CONTACT_EMAIL})", "Accept-Encoding": "gzip"}
+_EUTILS_COMMON = urllib.parse.urlencode(
+    {'db': 'pubmed', 'retmode': 'json', 'tool': 'carepathiq', 'email': CONTACT_EMAIL,
+     **({'api_key': NCBI_API_KEY} if NCBI_API_KEY else {})})
+_ESEARCH_PREFIX = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?" + _EUTILS_COMMON
+_ESUMMARY_PREFIX = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?" + _EUTILS_COMMON + "&version=2.0&id="
+# ESummary titles carry escaped inline markup such as &lt;i&gt;...&lt;/i&gt;.
+_TITLE_MARKUP = re.compile(r"&lt;/?(?:i|b|sup|sub)&gt;")
+# PMIDs and DOIs inside citation text (fetched or typed by hand); one pass finds both.
+_CITATION_ID = re.compile(r"\bPMID:?\s*(\d{1,8})\b|\b(10\.\d{4,9}/[^\s|\[\]]+)", re.IGNORECASE)
+
+
+def _link_citation_ids(citation):
+    """Turns each PMID/DOI in a citation into a Markdown link."""
+    def link(match):
+        if match.group(1):
+            return f"[{match.group(0)}](https://pubmed.ncbi.nlm.nih.gov/{match.group(1)}/)"
+        doi = match.group(2).rstrip(".,;")
+        # DOIs may contain balanced parentheses, e.g. 10.1016/S0140-6736(20)30183-5; a trailing
+        # unmatched ")" closes the surrounding text instead
+        while doi.endswith(")") and doi.count(")") > doi.count("("):
+            doi = doi[:-1].rstrip(".,;")
+        return f"[{doi}](https://doi.org/{doi})" + match.group(2)[len(doi):]
+    return _CITATION_ID.sub(link, citation)
+
+@dataclass(slots=True)
+class EvidenceRecord:
+    """A citation the user attached to one pathway element in phase 2."""
+    id: str
+    decision_point: str
+    element_type: str
+    verification: str = ""
+
+
+@dataclass(slots=True)
+class LogicNode:
+    """One phase 3 decision node and the evidence the user linked to it."""
+    node: str
+    evidence_link: str
+
+
+@dataclass(slots=True)
+class PathwayLogic:
+    """Phase 3 output: the decision tree and its validation walk-throughs."""
+    entry: str
+    endpoints: str
+    nodes: list
+    validation_scenarios: list = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class TestingResult:
+    """Phase 4 output."""
+    method: str
+    issues: str
+    mitigation: str
+    pilot_fatigue_feedback: str
+    status: str
+
+
+@dataclass(slots=True)
+class OperationsPlan:
+    """Phase 5 output."""
+    ehr: str
+    tools: str
+    tool_link: str
+    metrics: str
+    kpis: list = field(default_factory=list)  # metrics split on commas, parsed once in phase 5
+
+
+class _DiskCache:
+    """SQLite-backed JSON store keyed by a sha256 of the request; entries expire after ttl seconds."""
+
+    def __init__(self, path, table, ttl=7 * 24 * 3600):
+        self.table = table
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, payload BLOB, ts INTEGER)")
+        except (OSError, sqlite3.Error):
+            self._db = None  # caching is best-effort; run uncached if the directory is not writable
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256("|".join(str(p) for p in parts).encode()).hexdigest()
+
+    def get(self, key):
+        if self._db is None: return None
+        with self._lock:
+            row = self._db.execute(f"SELECT payload, ts FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    def set(self, key, value):
+        if self._db is None: return
+        payload = zlib.compress(json.dumps(value).encode())
+        with self._lock:
+            self._db.execute(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?)", (key, payload, int(time.time())))
+            self._db.commit()
 
 
 class ClinicalPathwayAgent:
-    def __init__(self):
+    SYSTEM_PROMPT = "You are CarePathIQ, an expert assistant for clinical pathway development."
+    _API_KEY_PATTERN = re.compile(r"sk-[A-Za-z0-9_\-]{17,}")
+
+    # --- DIALOGUE LIBRARY ---
+    _DIALOGUE = types.MappingProxyType({
+        "intro": "Hello! I'm your Clinical Pathway Agent. I'm here to help you transform your clinical expertise and evidence-based medicine into a robust clinical pathway.",
+        "phase_1_start": "\nLet's kick things off with the Scope. I'll ask you a few questions to frame the problem accurately.",
+        "phase_2_intro": "Great job on the scope. Now, let's look at the science. We need to make sure our pathway is evidence-based. Ready to evaluate some evidence?",
+        "phase_3_intro": "Now let's map out the logic. We need to ensure every decision point is clear and supported by the evidence we just gathered.",
+        "phase_4_intro": "A pathway only works if people actually use it. Let's simulate the workflow.",
+        "phase_5_intro": "We're in the home stretch. Now we need to operationalize this—turning a paper document into a live clinical tool.",
+        "step_verification": "\nI've finished gathering inputs for this section. Please review the summary preview above.",
+        "approval_request": ">> Do you approve this section? (Type 'YES' to proceed, anything else to abort): ",
+        "locked": "Section approved. Updating Documentation...\n",
+        "summary_generated": "The formal summary has been added to the report '{filename}'.\n"
+    })
+
+    # --- SMART OBJECTIVE TEMPLATES (used by refine_smart_goals) ---
+    _KPI_LIBRARY = types.MappingProxyType({
+        "imaging": "Reduce unnecessary {modality} imaging for {condition} by 20% within 12 months of go-live.",
+        "los": "Reduce median length of stay for {condition} to under {time} minutes within 6 months.",
+        "adherence": "Achieve >=90% adherence to the {guideline} within 6 months of go-live."
+    })
+
+    # --- CONSOLE PREVIEWS (phase 3 prototype, phase 5 dashboard), each written in one call ---
+    _PROTOTYPE_TEMPLATE = (
+        "\n[GENERATING PROTOTYPE]\n"
+        "   [{entry}]\n      |\n      v\n"
+        "{nodes_block}"
+        "   [{ends}]\n"
+    )
+    _DASHBOARD_TEMPLATE = (
+        "\nHere is a draft of the Dashboard Wireframe:\n"
+        "|----------------------------------------|\n"
+        "| PATHWAY: {condition}     |\n"
+        "|----------------------------------------|\n"
+        "| KPI 1: {kpi1}     |\n"
+        "| Adoption Rate: [ GRAPH ]               |\n"
+        "|----------------------------------------|\n"
+    )
+
+    # Answers that count as "no" to the phase 4 alert-fatigue question
+    _NEGATIVE_ANSWERS = frozenset({"no", "n", "nope", "none", "false", "0"})
+
+    # Objective keywords -> KPI template; one whole-word pass replaces per-keyword substring scans
+    _KPI_KEYWORDS = types.MappingProxyType({
+        "imaging": "imaging", "ct": "imaging", "mri": "imaging",
+        "length of stay": "los", "los": "los"
+    })
+    _KPI_PATTERN = re.compile(r"\b(?:" + "|".join(map(re.escape, _KPI_KEYWORDS)) + r")\b", re.IGNORECASE)
+
+    # --- SCOPE CHARTER TEMPLATE (used by _generate_summary_text) ---
+    _SCOPE_TEMPLATE = (
+        "\n## PROJECT SCOPE CHARTER: {condition}\n\n"
+        "**1. Problem Statement:**\n{problem}\n\n"
+        "**2. Target Population:**\n{population}\n\n"
+        "**3. Clinical Setting:**\n{setting}\n\n"
+        "**4. SMART Objectives:**\n{objectives}"
+        "\n**5. Operational Constraints:**\n{resources}\n\n"
+        "**6. Systems Integration:**\n{integration}\n"
+    )
+
+    def __init__(self, manifest=None):
+        # Batch mode: answers keyed by prompt name (see _ask); anything missing is asked interactively
+        self.manifest = manifest or {}
         print("\nWelcome to CarePathIQ.")
         print("To assist you best, I need to access my language reasoning tools.")
         
@@ -17,13 +213,15 @@ class ClinicalPathwayAgent:
         self.client = None
         attempts = 0
         while attempts < 3:
-            key = input("Please enter your OpenAI API Key (or press Enter to run in manual mode): ").strip()
+            key = self._ask("api_key", "Please enter your OpenAI API Key (or press Enter to run in manual mode): ", echo=False).strip()
             if not key:
                 print("No key provided. Running in manual mode.")
                 break
             if self._validate_api_key(key):
                 # attempt to initialize client
                 try:
+                    # Imported here so manual-mode sessions never load the openai package
+                    from openai import OpenAI
                     self.client = OpenAI(api_key=key)
                     self.api_key = key
                     print("...Connected. Ready to begin.")
@@ -35,7 +233,7 @@ class ClinicalPathwayAgent:
                 attempts += 1
                 print("Key format looks invalid. Ensure it starts with 'sk-' and try again.")
                 if attempts < 3:
-                    try_again = input("Try again? (y/n): ").strip().lower()
+                    try_again = self._ask("retry_api_key", "Try again? (y/n): ").strip().lower()
                     if try_again != 'y':
                         print("Proceeding in manual mode.")
                         break
@@ -46,325 +244,308 @@ class ClinicalPathwayAgent:
         self.pathway_data = {
             "scope": {},
             "evidence": {},
-            "logic": {},
-            "testing": {},
-            "operations": {}
+            "logic": None,       # PathwayLogic once phase 3 is done
+            "testing": None,     # TestingResult once phase 4 is done
+            "operations": None   # OperationsPlan once phase 5 is done
         }
         
         self.evidence_bank = [] 
-        self.report_file = "clinical_pathway_progress.md"
+        self._candidate_memo = {}
+        cache_path = os.path.join(os.path.expanduser("~"), ".cache", "carepathiq", "cache.sqlite3")
+        self.pubmed_cache = _DiskCache(cache_path, "pubmed")
+        self.llm_cache = _DiskCache(cache_path, "llm", ttl=30 * 24 * 3600)
+        # Decision node names from earlier sessions, offered as tab completions in phase 3
+        self.node_cache = _DiskCache(cache_path, "nodes", ttl=365 * 24 * 3600)
+        self._node_corpus = set(self.node_cache.get("names") or [])
+        self._enable_line_editing()
+        self.report_file = self.manifest.get("report_file", "clinical_pathway_progress.md")
         
-        # Initialize files
-        with open(self.report_file, "w") as f:
-            f.write("# Clinical Pathway Development Report\n")
-            f.write(f"Generated: {time.strftime('%Y-%m-%d %H:%M')}\n\n")
-
-        # --- DIALOGUE LIBRARY ---
-        self.dialogue = {
-            "intro": "Hello! I'm your Clinical Pathway Agent. I'm here to help you transform your clinical expertise and evidence-based medicine into a robust clinical pathway.",
-            "phase_1_start": "\nLet's kick things off with the Scope. I'll ask you a few questions to frame the problem accurately.",
-            "phase_2_intro": "Great job on the scope. Now, let's look at the science. We need to make sure our pathway is evidence-based. Ready to evaluate some evidence?",
-            "phase_3_intro": "Now let's map out the logic. We need to ensure every decision point is clear and supported by the evidence we just gathered.",
-            "phase_4_intro": "A pathway only works if people actually use it. Let's simulate the workflow.",
-            "phase_5_intro": "We're in the home stretch. Now we need to operationalize this—turning a paper document into a live clinical tool.",
-            "step_verification": "\nI've finished gathering inputs for this section. Please review the summary preview above.",
-            "approval_request": ">> Do you approve this section? (Type 'YES' to proceed, anything else to abort): ",
-            "locked": "Section approved. Updating Documentation...\n",
-            "summary_generated": "The formal summary has been saved to '{filename}'.\n"
-        }
+        # Report sections are buffered and written once when the session ends
+        self._report_buffer = [
+            "# Clinical Pathway Development Report\n",
+            f"Generated: {time.strftime('%Y-%m-%d %H:%M')}\n\n"
+        ]
+        self._report_writer = None
+
+        # Approved phase data is appended here as it is approved, one JSON line per phase.
+        # Opened in append mode on the first approval so earlier (possibly crashed) runs are kept.
+        self._progress_fp = None
+        self._run_started = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+        self.dialogue = self._DIALOGUE
+        # Conversational pauses between prompts are off unless CPA_ANIMATE=1
+        self.animate = os.environ.get("CPA_ANIMATE", "") not in ("", "0")
+        self.animate_delay = 0.05
+        self.kpi_library = self._KPI_LIBRARY
 
     # ==========================================
     # INTERNAL HELPER METHODS
     # ==========================================
-    def ask_assistant(self, prompt, context=""):
+    def _enable_line_editing(self):
+        """Turns on readline history (kept in ~/.cpa_history) for interactive sessions."""
+        if readline is None or not sys.stdin.isatty():
+            return
+        history_file = os.path.expanduser("~/.cpa_history")
+        try:
+            readline.read_history_file(history_file)
+        except OSError:
+            pass  # first run, or unreadable history
+        readline.set_history_length(1000)
+
+        def save_history():
+            try:
+                readline.write_history_file(history_file)
+            except OSError:
+                pass
+        atexit.register(save_history)
+
+    def _bind_tab(self, complete):
+        """Binds Tab to completion (decision-node loop only) or back to inserting a tab."""
+        if "libedit" in (readline.__doc__ or ""):
+            readline.parse_and_bind("bind ^I rl_complete" if complete else "bind ^I ed-insert")
+        else:
+            readline.parse_and_bind("tab: complete" if complete else "tab: tab-insert")
+
+    def _complete_node(self, text, state):
+        matches = sorted(name for name in self._node_corpus if name.startswith(text))
+        return matches[state] if state < len(matches) else None
+
+    def _manifest_answer(self, key, element=None):
+        """The manifest's answer for `key`, or None. For a per-element prompt, `element` is (index, name)
+        and the answer may be one string for all elements, a list in element order, or a dict keyed by name."""
+        answer = self.manifest.get(key)
+        if element is not None:
+            index, name = element
+            if isinstance(answer, dict):
+                answer = answer.get(name)
+            elif isinstance(answer, list):
+                answer = answer[index] if index < len(answer) else None
+        return None if answer is None else str(answer)
+
+    def _ask(self, key, prompt, echo=True, element=None):
+        """Answers a prompt from the batch manifest when it has `key`, otherwise asks the user."""
+        answer = self._manifest_answer(key, element)
+        if answer is None:
+            if not echo and sys.stdin.isatty():
+                # getpass bypasses readline, so secrets never reach ~/.cpa_history
+                return getpass.getpass(prompt)
+            return input(prompt)
+        print(prompt + (answer if echo else "[from manifest]"))
+        return answer
+
+    def _say(self, *lines):
+        """Prints consecutive console lines with one write (input() flushes before prompting)."""
+        sys.stdout.write("\n".join(lines) + "\n")
+
+    def _pause(self):
+        if self.animate:
+            time.sleep(self.animate_delay)
+
+    def ask_assistant(self, prompt, context="", json_mode=False):
         """Wrapper for OpenAI calls"""
         if not self.client: return "Analysis unavailable (No Key)"
         
-        full_prompt = f"{context}\n\nTask: {prompt}"
+        # Stable role/context goes in the system message so repeated calls share a cacheable prefix.
+        messages = [{"role": "system", "content": context or self.SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+        cache_key = _DiskCache.key("gpt-3.5-turbo", messages[0]["content"], prompt, json_mode)
+        cached = self.llm_cache.get(cache_key)
+        if cached is not None: return cached
+        extra = {"response_format": {"type": "json_object"}} if json_mode else {}
         try:
             response = self.client.chat.completions.create(
                 model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": full_prompt}],
-                temperature=0.3
+                messages=messages,
+                temperature=0,
+                **extra
             )
-            return response.choices[0].message.content.strip()
+            answer = response.choices[0].message.content.strip()
         except Exception as e:
             return "I couldn't process that right now."
+        self.llm_cache.set(cache_key, answer)
+        return answer
 
-    def draft_flowchart(self):
-        """Converts logic nodes into a visual diagram"""
-        logic = self.pathway_data.get('logic', {})
-        prompt = f"""
-        Create a Mermaid.js flowchart (graph TD) for:
-        Entry: {logic.get('entry')}
-        Nodes: {logic.get('nodes')}
-        Exit: {logic.get('endpoints')}
-        
-        Output ONLY the raw code inside the mermaid block.
-        """
-        result = self.ask_assistant(prompt, context="You are a Clinical Systems Architect.")
-        return result.replace("```mermaid", "").replace("```", "").strip()
+    def verify_evidence(self, studies):
+        """Checks every (citation, decision point) pair in one LLM call; verdicts are cached per row."""
+        if not self.client or not studies: return
+        keys = [_DiskCache.key("verify", s.id, s.decision_point) for s in studies]
+        verdicts = [self.llm_cache.get(k) for k in keys]
+        pending = [i for i, v in enumerate(verdicts) if v is None]
+        if pending:
+            # Rows are sorted by content (not entry order) so the same evidence always yields the same prompt.
+            pending.sort(key=lambda i: (studies[i].decision_point, studies[i].id))
+            rows = [{"idx": n, "decision_point": studies[i].decision_point, "citation": studies[i].id} for n, i in enumerate(pending)]
+            prompt = ("For each row, judge whether the citation supports the decision point. "
+                      'Return JSON {"results": [{"idx": <int>, "verdict": "Verified" or "Warning", "reason": <one sentence>}]} '
+                      "with one entry per row.\n" + json.dumps(rows))
+            answer = self.ask_assistant(prompt, context="You are a clinical evidence reviewer.", json_mode=True)
+            try:
+                results = json.loads(answer).get("results", [])
+            except (ValueError, AttributeError):
+                results = []
+            for row in results:
+                n = row.get("idx") if isinstance(row, dict) else None
+                if isinstance(n, int) and 0 <= n < len(pending):
+                    i = pending[n]
+                    verdicts[i] = f"{row.get('verdict', 'Warning')}: {row.get('reason', '')}".strip()
+                    self.llm_cache.set(keys[i], verdicts[i])
+        for study, verdict in zip(studies, verdicts):
+            if verdict:
+                study.verification = verdict
 
     def _validate_api_key(self, key: str) -> bool:
-        """Simple validation: non-empty, starts with 'sk-' and reasonable length."""
-        if not key or not isinstance(key, str):
-            return False
-        if not key.startswith("sk-"):
-            return False
-        if len(key) < 20:
-            return False
-        return True
+        """Simple validation: starts with 'sk-', key characters only, at least 20 long."""
+        return isinstance(key, str) and self._API_KEY_PATTERN.fullmatch(key) is not None
 
     # ==========================================
     # PUBMED API INTEGRATION
     # ==========================================
-    def search_pubmed(self, query, retmax=3):
-        base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
-        search_params = {
-            'db': 'pubmed', 'term': query, 'retmode': 'json', 'retmax': retmax,
-            'tool': 'carepathiq', 'email': 'example@example.com'
-        }
-        try:
-            url = base_url + "esearch.fcgi?" + urllib.parse.urlencode(search_params)
-            with urllib.request.urlopen(url) as response:
-                data = json.loads(response.read().decode())
-                id_list = data.get('esearchresult', {}).get('idlist', [])
-            
-            if not id_list: return []
-
-            summary_params = {'db': 'pubmed', 'id': ','.join(id_list), 'retmode': 'json', 'tool': 'carepathiq', 'email': 'example@example.com'}
-            url = base_url + "esummary.fcgi?" + urllib.parse.urlencode(summary_params)
-            with urllib.request.urlopen(url) as response:
-                data = json.loads(response.read().decode())
-                result = data.get('result', {})
-                citations = []
-                for uid in id_list:
-                    if uid in result:
-                        item = result[uid]
-                        title = item.get('title', 'No Title').replace("&lt;i&gt;", "").replace("&lt;/i&gt;", "")
-                        authors = item.get('authors', [])
-                        first_author = authors[0]['name'] if authors else "Unknown"
-                        pub_date = item.get('pubdate', 'No Date')[:4]
-                        source = item.get('source', 'Journal')
-                        citations.append(f"{first_author} et al. ({pub_date}). {title}. {source}.")
-                return citations
-        except Exception:
-            print(f"\n[Note] PubMed search timed out or failed.")
-            return []
+    # NCBI allows 3 requests/second per client, or 10/second with an API key.
+    _ncbi_interval = 1.0 / (10 if NCBI_API_KEY else 3)
+    _ncbi_lock = threading.Lock()
+    _ncbi_next_slot = 0.0
+    _ncbi_local = threading.local()
 
-    # ==========================================
-    # CORE EXECUTION
-    # ==========================================
-    def execute_process(self):
-        print(self.dialogue["intro"])
-        time.sleep(1)
-        
-        try:
-            self.phase_1_scope()
-            if not self.review_and_save("scope", "Phase 1: Scope & Objectives", 1): return
-            
-            self.phase_2_evidence()
-            if not self.review_and_save("evidence", "Phase 2: Evidence Appraisal", 2): return
-            
-            self.phase_3_logic()
-            if not self.review_and_save("logic", "Phase 3: Decision Logic", 3): return
-            
-            self.phase_4_testing()
-            if not self.review_and_save("testing", "Phase 4: Validation", 4): return
-            
-            self.phase_5_ops()
-            if not self.review_and_save("operations", "Phase 5: Operations", 5): return
+    def _ncbi_connection(self, fresh=False):
+        """Per-thread keep-alive HTTPS connection, so ESearch/ESummary skip the TLS handshake."""
+        conn = getattr(self._ncbi_local, "conn", None)
+        if conn is None or fresh:
+            if conn is not None:
+                conn.close()
+            conn = self._ncbi_local.conn = http.client.HTTPSConnection("eutils.ncbi.nlm.nih.gov", timeout=10)
+        return conn
 
-            self.finish()
-        except KeyboardInterrupt:
-            print("\n\nSession paused.")
-            sys.exit()
+    _RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
 
-    def review_and_save(self, phase_key, title, phase_num):
-        print(f"\n...Drafting summary for {title}...")
-        time.sleep(1)
-        summary_text = self._format_summary(phase_key, title)
-        print("\n" + title + "\n" + "="*40 + "\n" + summary_text.strip() + "\n" + "="*40 + "\n")
-        
-        print(self.dialogue["step_verification"])
-        response = input(self.dialogue["approval_request"])
-        if response.lower().strip() == "yes":
-            with open(self.report_file, "a") as f:
-                f.write(summary_text + "\n" + "-"*40 + "\n")
-            print(self.dialogue["locked"])
-            input("Press Enter to continue...")
-            return True
-        return False
+    def _pubmed_get(self, url, attempts=4):
+        """Throttled GET against E-utilities; retries 429/5xx honoring Retry-After, else backing off ~1s, 2s, 4s."""
+        parts = urllib.parse.urlsplit(url)
+        path = f"{parts.path}?{parts.query}"
+        for attempt in range(attempts):
+            with ClinicalPathwayAgent._ncbi_lock:
+                now = time.monotonic()
+                wait = ClinicalPathwayAgent._ncbi_next_slot - now
+                ClinicalPathwayAgent._ncbi_next_slot = max(now, ClinicalPathwayAgent._ncbi_next_slot) + self._ncbi_interval
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                conn = self._ncbi_connection()
+                conn.request("GET", path, headers=_EUTILS_HEADERS)
+                response = conn.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                # NCBI closes idle keep-alive sockets; reopen and retry.
+                self._ncbi_connection(fresh=True)
+                if attempt == attempts - 1:
+                    raise
+                continue
+            if response.status in self._RETRY_STATUSES and attempt < attempts - 1:
+                retry_after = response.getheader("Retry-After", "")
+                # Jitter keeps the worker threads from retrying in lockstep
+                time.sleep(min(float(retry_after), 60.0) if retry_after.isdigit() else 2 ** attempt + random.random())
+                continue
+            if response.status != 200:
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+            if response.getheader("Content-Encoding", "") == "gzip":
+                body = gzip.decompress(body)
+            return orjson.loads(body) if orjson else json.loads(body)
 
-    def _format_summary(self, phase_key, title):
-        data = self.pathway_data.get(phase_key, {})
-        
-        if phase_key == 'scope':
-            return f"\n## SCOPE: {data.get('condition')}\n**Problem:** {data.get('problem')}\n**Pop:** {data.get('population')}\n**Obj:** {data.get('objectives')}\n"
-        
-        if phase_key == 'evidence':
-            txt = "\n### Rapid Evidence Appraisal\n| Decision | Citation | Analysis |\n|---|---|---|\n"
-            for s in data.get('studies', []):
-                txt += f"| {s.get('decision_point')} | {s.get('id')} | {s.get('analysis')} |\n"
-            return txt
-        
-        if phase_key == 'logic':
-            txt = f"\n### Logic Flowchart\n```mermaid\n{data.get('mermaid_visual')}\n```\n\n**Nodes:**\n"
-            for n in data.get('nodes', []):
-                txt += f"- {n['node']} (Ref: {n['evidence_link']})\n"
-            return txt
-        
-        if phase_key == 'testing':
-            return f"\n**Testing:** {data.get('status')}\n**Issues:** {data.get('issues')}\n"
+    def _report_pubmed_failure(self, error):
+        if isinstance(error, urllib.error.HTTPError) and error.code == 429:
+            print("\n[Note] PubMed is rate-limiting requests; try again shortly or set NCBI_API_KEY.")
+        else:
+            print(f"\n[Note] PubMed search timed out or failed.")
 
-        if phase_key == 'operations':
-            return f"\n**EHR:** {data.get('ehr')}\n**KPIs:** {data.get('metrics')}\n"
+    def _esearch(self, query, retmax=3):
+        """Returns the PubMed UIDs matching a query."""
+        data = self._pubmed_get(f"{_ESEARCH_PREFIX}&retmax={int(retmax)}&term={urllib.parse.quote_plus(query)}")
+        return data.get('esearchresult', {}).get('idlist', [])
 
-        return ""
+    def _esummary_bulk(self, uids):
+        """Fetches summaries for many UIDs at once (200 per request); returns {uid: item}."""
+        uids = list(dict.fromkeys(uids))
+        summaries = {}
+        for start in range(0, len(uids), 200):
+            result = self._pubmed_get(_ESUMMARY_PREFIX + ','.join(uids[start:start + 200])).get('result', {})
+            for uid in uids[start:start + 200]:
+                raw = result.get(uid)
+                if raw:
+                    # Keep only what _format_citation reads so the rest of the record can be freed
+                    item = {k: raw[k] for k in ('title', 'pubdate', 'source') if k in raw}
+                    item['authors'] = raw.get('authors', [])[:1]
+                    summaries[uid] = item
+        return summaries
 
-    # ==========================================
-    # PHASES
-    # ==========================================
-    def phase_1_scope(self):
-        print(self.dialogue["phase_1_start"])
-        self.pathway_data['scope']['condition'] = input("\nTarget Condition (e.g., Sepsis): ")
-        self.pathway_data['scope']['population'] = input("Target Population: ")
-        self.pathway_data['scope']['problem'] = input("Primary Problem: ")
-        self.pathway_data['scope']['objectives'] = input("Primary Objectives: ")
+    def _format_citation(self, uid, item):
+        title = html.unescape(_TITLE_MARKUP.sub("", item.get('title', 'No Title')))
+        authors = item.get('authors', [])
+        first_author = authors[0]['name'] if authors else "Unknown"
+        pub_date = item.get('pubdate', 'No Date')[:4]
+        source = item.get('source', 'Journal')
+        return f"{first_author} et al. ({pub_date}). {title}. {source}. PMID: {uid}"
 
-    def phase_2_evidence(self):
-        print(self.dialogue["phase_2_intro"])
-        condition = self.pathway_data['scope'].get('condition', 'General')
-        
-        print("\nLet's add decision nodes and search PubMed.")
-        final_elements = []
-        while True:
-            el_name = input("\nEnter a Decision Node (or type 'done'): ")
-            if el_name.lower() == 'done': break
-            final_elements.append(el_name)
-        
-        print("\nSearching literature...")
-        
-        for point in final_elements:
-            print(f"\n--- Searching for: {point} ---")
-            results = self.search_pubmed(f"({condition}) AND ({point}) AND (Guideline[pt])")
-            
-            selected_cite = "No citation"
-            
-            if results:
-                print(f"Found {len(results)} sources:")
-                for i, citation in enumerate(results, 1):
-                    print(f"{i}. {citation}")
-                sel = input("Select # (or type manual): ")
-                if sel.isdigit() and 1 <= int(sel) <= len(results):
-                    selected_cite = results[int(sel)-1]
-                else:
-                    selected_cite = sel
-            else:
-                selected_cite = input("No hits. Enter manual citation: ")
-            
-            # --- NATURAL LANGUAGE CHECK ---
-            print(f"   ...Reviewing clinical relevance...")
-            analysis = self.ask_assistant(f"Does the citation '{selected_cite}' support the decision '{point}'? Answer 'Verified' or 'Warning' with brief reason.")
-            print(f"   >> {analysis}")
-
-            self.evidence_bank.append({
-                "id": selected_cite, 
-                "decision_point": point,
-                "analysis": analysis
-            })
-            
-        self.pathway_data['evidence']['studies'] = self.evidence_bank
+    def search_pubmed(self, query, retmax=3):
+        cache_key = _DiskCache.key(query, retmax)
+        cached = self.pubmed_cache.get(cache_key)
+        if cached is not None: return cached
+        try:
+            id_list = self._esearch(query, retmax)
+            result = self._esummary_bulk(id_list) if id_list else {}
+        except Exception as e:
+            self._report_pubmed_failure(e)
+            return []
+        citations = [self._format_citation(uid, result[uid]) for uid in id_list if uid in result]
+        self.pubmed_cache.set(cache_key, citations)
+        return citations
 
-    def phase_3_logic(self):
-        print(self.dialogue["phase_3_intro"])
-        entry = input("\nPathway Entry Point: ")
-        ends = input("Pathway Endpoint: ")
-        
-        logic_nodes = []
-        for study in self.evidence_bank:
-            logic_nodes.append({"node": study['decision_point'], "evidence_link": "See Evidence Table"})
-        
-        self.pathway_data['logic'] = { "entry": entry, "endpoints": ends, "nodes": logic_nodes }
-        
-        # --- NATURAL VISUALIZATION ---
-        print("\n...Drafting the flowchart layout...")
-        mermaid = self.draft_flowchart()
-        self.pathway_data['logic']['mermaid_visual'] = mermaid
-        print(">> Visual diagram created.")
+    def _evidence_query(self, point, condition):
+        """Guideline/systematic-review query for one element, whitespace-normalized; case is kept since PubMed operators are upper-case."""
+        point = " ".join(point.split())
+        condition = " ".join(condition.split())
+        return f"({condition}) AND ({point}) AND (Guideline[pt] OR Systematic Review[pt])"
 
-    def phase_4_testing(self):
-        print(self.dialogue["phase_4_intro"])
-        issues = input("Top Usability Issues found: ")
-        mitigation = input("Mitigation Plans: ")
-        status = input("Validation Status (Ready/Not Ready): ")
-        self.pathway_data['testing'] = { "issues": issues, "mitigation": mitigation, "status": status }
+    def _fetch_candidates(self, node, condition):
+        """PubMed candidates for a decision node, memoized for the session (and on disk via search_pubmed)."""
+        query = self._evidence_query(node, condition)
+        if query not in self._candidate_memo:
+            candidates = self.search_pubmed(query)
+            if not candidates:
+                return candidates  # don't pin a failed or empty lookup for the rest of the session
+            self._candidate_memo[query] = candidates
+        return self._candidate_memo[query]
 
-    def phase_5_ops(self):
-        print(self.dialogue["phase_5_intro"])
-        ehr = input("\nEHR System: ")
-        metrics = input("Key Performance Indicators (KPIs): ")
-        self.pathway_data['operations'] = { "ehr": ehr, "metrics": metrics }
+    def _gather_evidence(self, elements, condition, retmax=3):
+        """Runs every uncached element's ESearch concurrently, then one bulk ESummary; results keep element order."""
+        queries = [self._evidence_query(el['name'], condition) for el in elements]
+        cache_keys = [_DiskCache.key(q, retmax) for q in queries]
+        results = [self.pubmed_cache.get(k) for k in cache_keys]
+        pending = [i for i, cached in enumerate(results) if cached is None]
+        if not pending: return results
 
-    def finish(self):
-        print("\n" + "="*60)
-        print("WORKSHOP COMPLETE")
-        print(f"I've compiled the full report here: '{self.report_file}'")
-        print("="*60)
+        errors = []
 
-if __name__ == "__main__":
-    agent = ClinicalPathwayAgent()
-    agent.execute_process()
-        search_params = {
-            'db': 'pubmed',
-            'term': query,
-            'retmode': 'json',
-            'retmax': retmax,
-            'tool': 'clinical_pathway_agent',
-            'email': 'example@example.com' # NCBI requires email contact
-        }
-        
-        try:
-            url = base_url + "esearch.fcgi?" + urllib.parse.urlencode(search_params)
-            with urllib.request.urlopen(url) as response:
-                data = json.loads(response.read().decode())
-                id_list = data.get('esearchresult', {}).get('idlist', [])
-            
-            if not id_list:
-                return []
-
-            # 2. ESummary: Get Details
-            summary_params = {
-                'db': 'pubmed',
-                'id': ','.join(id_list),
-                'retmode': 'json',
-                'tool': 'clinical_pathway_agent',
-                'email': 'example@example.com'
-            }
-            
-            url = base_url + "esummary.fcgi?" + urllib.parse.urlencode(summary_params)
-            with urllib.request.urlopen(url) as response:
-                data = json.loads(response.read().decode())
-                result = data.get('result', {})
-                
-                citations = []
-                for uid in id_list:
-                    if uid in result:
-                        item = result[uid]
-                        # Safe extraction of fields
-                        title = item.get('title', 'No Title')
-                        # Authors list might be missing
-                        authors = item.get('authors', [])
-                        first_author = authors[0]['name'] if authors else "Unknown Author"
-                        pub_date = item.get('pubdate', 'No Date')[:4] # Just the year
-                        source = item.get('source', 'Journal')
-                        
-                        citations.append(f"{first_author} et al. ({pub_date}). {title}. {source}.")
-                return citations
+        def safe_esearch(query):
+            try:
+                return self._esearch(query, retmax)
+            except Exception as e:
+                errors.append(e)
+                return None
 
+        with ThreadPoolExecutor(max_workers=min(len(pending), 10)) as pool:
+            id_lists = dict(zip(pending, pool.map(safe_esearch, [queries[i] for i in pending])))
+        if errors:
+            self._report_pubmed_failure(errors[0])
+        try:
+            summaries = self._esummary_bulk([uid for ids in id_lists.values() if ids for uid in ids])
         except Exception as e:
-            print(f"\n[System Alert] PubMed Search failed (Check internet connection): {e}")
-            return []
+            self._report_pubmed_failure(e)
+            return [r if r is not None else [] for r in results]
+        for i, ids in id_lists.items():
+            if ids is None:
+                results[i] = []
+                continue
+            results[i] = [self._format_citation(uid, summaries[uid]) for uid in ids if uid in summaries]
+            self.pubmed_cache.set(cache_keys[i], results[i])
+        return results
 
     # ==========================================
     # CORE EXECUTION
@@ -374,7 +555,7 @@ if __name__ == "__main__":
         Execute the pathway development process sequentially.
         """
         print(self.dialogue["intro"])
-        time.sleep(1)
+        self._pause()
         
         try:
             # Phase 1
@@ -402,14 +583,37 @@ if __name__ == "__main__":
         except KeyboardInterrupt:
             print("\n\nProcess aborted by user.")
             sys.exit()
+        finally:
+            if self._report_writer:
+                self._report_writer.join()
+            else:
+                self._flush_report()
+            if self._progress_fp:
+                self._progress_fp.close()
+
+    def _record_phase(self, phase_key):
+        """Writes one approved phase to the JSONL progress log so completed work survives a crash."""
+        record = {"run": self._run_started, "phase": phase_key, "data": self.pathway_data[phase_key]}
+        if orjson:
+            line = orjson.dumps(record).decode()  # serializes EvidenceRecord dataclasses natively
+        else:
+            line = json.dumps(record, separators=(',', ':'), default=dataclasses.asdict)
+        if self._progress_fp is None:
+            self._progress_fp = open(os.path.splitext(self.report_file)[0] + ".jsonl", "a", buffering=1)
+        self._progress_fp.write(line + "\n")
+
+    def _flush_report(self):
+        """Writes all approved sections to the report file in one go."""
+        with open(self.report_file, "w") as f:
+            f.write("".join(self._report_buffer))
 
     def verify_step(self, phase_name):
         """Human-in-the-loop verification."""
         print(self.dialogue["step_verification"])
-        response = input(self.dialogue["approval_request"])
+        response = self._ask("approve", self.dialogue["approval_request"])
         if response.lower().strip() == "yes":
             print(self.dialogue["locked"])
-            time.sleep(1) # Conversational pause
+            self._pause() # Conversational pause
             return True
         else:
             print("Process Paused/Aborted for refinement.")
@@ -418,29 +622,26 @@ if __name__ == "__main__":
     def review_and_save_phase(self, phase_key, title, phase_num):
         """Generates summary, shows preview, asks for verification, saves MD."""
         print(f"\n...Drafting formal summary for {title}...")
-        time.sleep(1)
+        self._pause()
         
         # 1. Generate MD content
         summary_text = self._generate_summary_text(phase_key, title)
         
         # 2. Show Preview in Console
-        print("\n" + title)
-        print("="*40)
-        print(summary_text.strip())
-        print("="*40 + "\n")
+        self._say("\n" + title, "="*40, summary_text.strip(), "="*40 + "\n")
 
         # 3. Verify
         if self.verify_step(title):
-            # 4. Save to Markdown
-            with open(self.report_file, "a") as f:
-                f.write(summary_text + "\n" + "-"*40 + "\n")
+            # 4. Add to the report (written to Markdown when the session ends)
+            self._report_buffer.append(summary_text + "\n" + "-"*40 + "\n")
+            self._record_phase(phase_key)
             
             # 5. Print Progress
             percent = int((phase_num / 5) * 100)
             print(f"--> PROCESS STATUS: {percent}% COMPLETE")
             
             print(self.dialogue["summary_generated"].format(filename=self.report_file))
-            input("Press Enter to continue to the next phase...")
+            self._ask("continue", "Press Enter to continue to the next phase...")
             return True
         return False
 
@@ -449,102 +650,115 @@ if __name__ == "__main__":
         data = self.pathway_data.get(phase_key, {})
         
         if phase_key == 'scope':
-            summary_text = f"\n## PROJECT SCOPE CHARTER: {data.get('condition', 'Clinical Pathway')}\n\n"
-            summary_text += f"**1. Problem Statement:**\n{data.get('problem', 'N/A')}\n\n"
-            summary_text += f"**2. Target Population:**\n{data.get('population', 'N/A')}\n\n"
-            summary_text += f"**3. Clinical Setting:**\n{data.get('setting', 'N/A')}\n\n"
-            summary_text += f"**4. SMART Objectives:**\n"
-            for obj in data.get('objectives', []):
-                summary_text += f"- {obj}\n"
-            summary_text += f"\n**5. Operational Constraints:**\n{data.get('resources', 'N/A')}\n\n"
-            summary_text += f"**6. Systems Integration:**\n{data.get('integration', 'N/A')}\n"
-            return summary_text
+            return self._SCOPE_TEMPLATE.format(
+                condition=data.get('condition', 'Clinical Pathway'),
+                problem=data.get('problem', 'N/A'),
+                population=data.get('population', 'N/A'),
+                setting=data.get('setting', 'N/A'),
+                objectives="".join(f"- {obj}\n" for obj in data.get('objectives', [])),
+                resources=data.get('resources', 'N/A'),
+                integration=data.get('integration', 'N/A')
+            )
             
-        summary_text = f"\n## {title}\n"
+        parts = [f"\n## {title}\n"]
         
         if phase_key == 'evidence':
-            summary_text += f"**PICO Framework:** {data.get('PICO', {})}\n\n"
+            parts.append(f"**PICO Framework:** {data.get('PICO', {})}\n\n")
             # RAPID EVIDENCE APPRAISAL TABLE
-            summary_text += "### Rapid Evidence Appraisal\n"
-            summary_text += "| Decision Tree Element | Definition, Rationale, or Risk Score | PubMed Citations |\n"
-            summary_text += "| :--- | :--- | :--- |\n"
+            parts.append("### Rapid Evidence Appraisal\n")
+            parts.append("| Decision Tree Element | Definition, Rationale, or Risk Score | PubMed Citations |\n")
+            parts.append("| :--- | :--- | :--- |\n")
             
             for study in data.get('studies', []):
                 # We categorize the row based on the user's input in Phase 2
-                element_type = study.get('element_type', 'Decision Node')
-                point_name = study.get('decision_point', 'General')
-                citation = study.get('id', 'No citation')
+                element_type = study.element_type
+                point_name = study.decision_point
+                citation = study.id
                 
-                # Logic to extract "Definition" from the citation title if possible
-                try:
-                    parts = citation.split('. ')
-                    if len(parts) >= 3:
-                        definition = parts[1] # Use Title as definition/rationale
-                    else:
-                        definition = f"Evidence for {point_name}"
-                except:
+                # Use the citation title as the definition/rationale when it has one
+                citation_parts = citation.split('. ')
+                if len(citation_parts) >= 3:
+                    definition = citation_parts[1]
+                else:
                     definition = f"Evidence for {point_name}"
                 
-                summary_text += f"| {element_type} | **{point_name}**: {definition} | {citation} |\n"
+                parts.append(f"| {element_type} | **{point_name}**: {definition} | {_link_citation_ids(citation)} |\n")
         
         elif phase_key == 'logic':
-            summary_text += f"**Entry:** {data.get('entry')}\n"
-            summary_text += f"**Endpoints:** {data.get('endpoints')}\n"
-            summary_text += "**Decision Nodes:**\n"
-            for node in data.get('nodes', []):
-                summary_text += f"- {node['node']}\n"
-                summary_text += f"  - Supporting Evidence: {node['evidence_link']}\n"
+            parts.append(f"**Entry:** {data.entry}\n")
+            parts.append(f"**Endpoints:** {data.endpoints}\n")
+            parts.append("**Decision Nodes:**\n")
+            for node in data.nodes:
+                parts.append(f"- {node.node}\n")
+                parts.append(f"  - Supporting Evidence: {node.evidence_link}\n")
         
         elif phase_key == 'testing':
-            summary_text += f"**Method:** {data.get('method')}\n"
-            summary_text += f"**Status:** {data.get('status')}\n"
-            summary_text += f"**Key Issues:** {data.get('issues')}\n"
+            parts.append(f"**Method:** {data.method}\n")
+            parts.append(f"**Status:** {data.status}\n")
+            parts.append(f"**Key Issues:** {data.issues}\n")
 
         elif phase_key == 'operations':
-            summary_text += f"**EHR System:** {data.get('ehr')}\n"
-            summary_text += f"**Metrics:** {data.get('metrics')}\n"
+            parts.append(f"**EHR System:** {data.ehr}\n")
+            parts.append(f"**Metrics:** {', '.join(data.kpis) or 'N/A'}\n")
             
-        return summary_text
+        return "".join(parts)
 
     def refine_smart_goals(self, objectives_input, condition):
         print("\nAnalyzing your objectives against SMART criteria...")
-        time.sleep(0.5)
+        self._pause()
         suggestions = []
-        input_lower = objectives_input.lower()
-        if "imaging" in input_lower or "ct" in input_lower:
+        matched = {self._KPI_KEYWORDS[m.group(0).lower()] for m in self._KPI_PATTERN.finditer(objectives_input)}
+        if "imaging" in matched:
             suggestions.append(self.kpi_library["imaging"].format(modality="CT/MRI", condition=condition))
-        if "length of stay" in input_lower or "los" in input_lower:
+        if "los" in matched:
             suggestions.append(self.kpi_library["los"].format(condition=condition, time="180"))
         if not suggestions:
             suggestions.append(self.kpi_library["adherence"].format(guideline="Standard Protocol"))
         return suggestions
 
     def assess_health_equity(self):
-        print("\nEvaluating Risk of Bias...")
-        print("Let's look at the demographics of the evidence sources.")
-        print("1. Does the evidence source include diverse populations?")
-        print("2. Are there race-based corrections in the algorithms (e.g., eGFR, VBAC)?")
-        equity_notes = input(">> Please document any Equity Findings or Exclusions: ")
+        self._say("\nEvaluating Risk of Bias...",
+                  "Let's look at the demographics of the evidence sources.",
+                  "1. Does the evidence source include diverse populations?",
+                  "2. Are there race-based corrections in the algorithms (e.g., eGFR, VBAC)?")
+        equity_notes = self._ask("equity_notes", ">> Please document any Equity Findings or Exclusions: ")
         self.pathway_data['evidence']['equity_scan'] = equity_notes
 
     def validate_logic(self):
         print("\nLet's validate the logic by walking through 3 key scenarios.")
-        scenarios = ["Typical Patient", "Edge Case (Comorbidity)", "High-Risk/Exclusion"]
+        scenarios = [("typical_patient", "Typical Patient"), ("edge_case", "Edge Case (Comorbidity)"), ("high_risk", "High-Risk/Exclusion")]
         results = []
-        for s in scenarios:
-            res = input(f">> What is the expected pathway output for a '{s}'? ")
+        for key, s in scenarios:
+            res = self._ask(key, f">> What is the expected pathway output for a '{s}'? ")
             results.append(f"{s}: {res}")
-        self.pathway_data['logic']['validation_scenarios'] = results
+        self.pathway_data['logic'].validation_scenarios = results
 
-    def search_evidence_workflow(self, node, condition):
-        """Simulates a literature search workflow for a specific decision node."""
+    def search_evidence_workflow(self, node, condition, candidates=None, answers=None):
+        """Runs a literature search for a specific decision node and has the user confirm the evidence."""
         print(f"\nScanning Clinical Society Guidelines & PubMed for: '{node}' in context of '{condition}'...")
-        time.sleep(1.5)
-        print("...Search complete. I have identified potential evidence.")
+        if candidates is None:
+            candidates = self._fetch_candidates(node, condition)
+        if candidates:
+            self._say("...Search complete. I have identified potential evidence:",
+                      *(f"{i}. {citation}" for i, citation in enumerate(candidates, 1)),
+                      "Enter a number to use a source above, or type a citation/guideline.")
+        else:
+            print("...No direct hits found. Please enter the evidence manually.")
         print("Please review and confirm the top 1-2 evidence sources to support this decision node:")
         
-        e1 = input("Evidence #1 (Citation/Guideline): ")
-        e2 = input("Evidence #2 (Citation/Guideline) [Press Enter if none]: ")
+        choices = {str(i): citation for i, citation in enumerate(candidates, 1)}
+        
+        def resolve(sel):
+            return choices.get(sel.strip(), sel)
+        
+        if answers is not None:
+            # Per-node evidence from the manifest: up to two citations or candidate numbers
+            e1, e2 = (list(map(str, answers)) + ["", ""])[:2]
+            print(f"Evidence (from manifest): {e1}" + (f" | {e2}" if e2 else ""))
+            e1, e2 = resolve(e1), resolve(e2)
+        else:
+            e1 = resolve(self._ask("evidence_1", "Evidence #1 (Citation/Guideline): "))
+            e2 = resolve(self._ask("evidence_2", "Evidence #2 (Citation/Guideline) [Press Enter if none]: "))
         
         combined = e1
         if e2.strip():
@@ -555,36 +769,37 @@ if __name__ == "__main__":
     # PHASES (INPUTS)
     # ==========================================
     def phase_1_scope_and_objectives(self):
+        scope = self.pathway_data['scope']
         print(self.dialogue["phase_1_start"])
-        time.sleep(1)
+        self._pause()
         
-        self.pathway_data['scope']['condition'] = input("\nFirst, what is the Clinical Condition we are targeting? (e.g., Sepsis): ")
-        self.pathway_data['scope']['setting'] = input("And what Care Setting will this be used in? (e.g., ED, ICU): ")
-        self.pathway_data['scope']['population'] = input("Who is the Target Population? (Please define inclusions/exclusions): ")
-        self.pathway_data['scope']['problem'] = input("What is the Primary Problem or Variation in care you want to address? ")
+        scope['condition'] = self._ask("condition", "\nFirst, what is the Clinical Condition we are targeting? (e.g., Sepsis): ")
+        scope['setting'] = self._ask("setting", "And what Care Setting will this be used in? (e.g., ED, ICU): ")
+        scope['population'] = self._ask("population", "Who is the Target Population? (Please define inclusions/exclusions): ")
+        scope['problem'] = self._ask("problem", "What is the Primary Problem or Variation in care you want to address? ")
         
         print("\nThanks. Now let's define what success looks like.")
-        raw_objectives = input("Please draft your Primary Objectives: ")
+        raw_objectives = self._ask("objectives", "Please draft your Primary Objectives: ")
         
-        refined = self.refine_smart_goals(raw_objectives, self.pathway_data['scope']['condition'])
+        refined = self.refine_smart_goals(raw_objectives, scope['condition'])
         print(f"\nHere are some suggestions to make them SMARTer:")
         for r in refined:
             print(f" - {r}")
         
-        use_suggestion = input(">> Would you like to use these suggestions? (yes/no): ")
+        use_suggestion = self._ask("use_smart_suggestions", ">> Would you like to use these suggestions? (yes/no): ")
         if use_suggestion.lower() == 'yes':
-            self.pathway_data['scope']['objectives'] = refined
+            scope['objectives'] = refined
         else:
-            self.pathway_data['scope']['objectives'] = [raw_objectives]
+            scope['objectives'] = [raw_objectives]
 
         print("\nA few more logistics...")
-        self.pathway_data['scope']['resources'] = input("Are there any Resource Constraints? (e.g., Staffing, Tech): ")
-        self.pathway_data['scope']['workflow'] = input("What are the current Workflow Pain Points? ")
-        self.pathway_data['scope']['integration'] = input("Are there Existing Systems we need to integrate with? (e.g., EHR, Registries): ")
+        scope['resources'] = self._ask("resources", "Are there any Resource Constraints? (e.g., Staffing, Tech): ")
+        scope['workflow'] = self._ask("workflow", "What are the current Workflow Pain Points? ")
+        scope['integration'] = self._ask("integration", "Are there Existing Systems we need to integrate with? (e.g., EHR, Registries): ")
 
     def phase_2_evidence_appraisal(self):
         print(self.dialogue["phase_2_intro"])
-        time.sleep(1)
+        self._pause()
         
         pico = {}
         print("\nLet's define the PICO framework. I've drafted this based on your Phase 1 inputs:")
@@ -601,16 +816,15 @@ if __name__ == "__main__":
         print(f"Comparison (C): {pico['C']}")
         
         # Prompt for Outcome
-        pico['O'] = input("Outcome (O) (e.g., Reduced Length of Stay, Mortality): ")
+        pico['O'] = self._ask("outcome", "Outcome (O) (e.g., Reduced Length of Stay, Mortality): ")
         self.pathway_data['evidence']['PICO'] = pico
 
-        print("\nNow, let's gather the evidence.")
-        print("I can help you grade the evidence (High/Moderate/Low/Very Low).") 
-        
         # Suggest Decision Tree Elements
-        print("\nI suggest structuring the pathway with the following Decision Tree Elements:")
-        print("Types: Start Node, End Node, Decision Node, Process Step, Note.")
-        print("(A 'Note' includes additional info like detailed risk scores referenced by other nodes).")
+        self._say("\nNow, let's gather the evidence.",
+                  "I can help you grade the evidence (High/Moderate/Low/Very Low).",
+                  "\nI suggest structuring the pathway with the following Decision Tree Elements:",
+                  "Types: Start Node, End Node, Decision Node, Process Step, Note.",
+                  "(A 'Note' includes additional info like detailed risk scores referenced by other nodes).")
         
         condition = self.pathway_data['scope'].get('condition', 'General Condition')
         
@@ -623,142 +837,195 @@ if __name__ == "__main__":
             {"type": "End Node", "name": "Disposition (Admit vs. Discharge)"}
         ]
         
-        print("\nProposed Structure:")
-        for i, el in enumerate(proposed_elements, 1):
-            print(f"{i}. [{el['type']}] {el['name']}")
-            
-        choice = input("\n>> Do you approve this structure? (Type 'YES' to proceed, or anything else to Modify): ")
+        self._say("\nProposed Structure:", *(f"{i}. [{el['type']}] {el['name']}" for i, el in enumerate(proposed_elements, 1)))
         
+        background = ThreadPoolExecutor(max_workers=2)
         final_elements = []
+        prefetch = None
         
-        if choice.lower().strip() == 'yes':
-            final_elements = proposed_elements
+        if "elements" in self.manifest:
+            # Batch mode: the manifest lists the structure as [{"type": ..., "name": ...}, ...]
+            final_elements = [{"type": el["type"], "name": el["name"]} for el in self.manifest["elements"]]
+            self._say("Using the element list from the manifest:",
+                      *(f"{i}. [{el['type']}] {el['name']}" for i, el in enumerate(final_elements, 1)))
         else:
-            print("\nLet's customize your list. Please enter elements (Start, Decision, Process, Note, End).")
-            print("Type 'done' for Element Type to finish.")
-            while True:
-                el_type = input("\nElement Type (Start/Decision/Process/Note/End): ")
-                if el_type.lower() == 'done' or not el_type.strip():
-                    break
-                el_name = input("Element Name/Description: ")
-                final_elements.append({"type": el_type, "name": el_name})
+            # Start searching for the proposed structure while the user reviews it.
+            prefetch = background.submit(self._gather_evidence, proposed_elements, condition)
+            choice = self._ask("approve_structure", "\n>> Do you approve this structure? (Type 'YES' to proceed, or anything else to Modify): ")
+            
+            if choice.lower().strip() == 'yes':
+                final_elements = proposed_elements
+            else:
+                prefetch = None
+                self._say("\nLet's customize your list. Please enter elements (Start, Decision, Process, Note, End).",
+                          "Type 'done' for Element Type to finish.")
+                while True:
+                    el_type = input("\nElement Type (Start/Decision/Process/Note/End): ")
+                    if el_type.lower() == 'done' or not el_type.strip():
+                        break
+                    el_name = input("Element Name/Description: ")
+                    final_elements.append({"type": el_type, "name": el_name})
         
         print("\nStarting automated literature search on PubMed...")
+        all_results = prefetch.result() if prefetch else self._gather_evidence(final_elements, condition)
         
-        for item in final_elements:
+        for index, (item, results) in enumerate(zip(final_elements, all_results)):
             point = item['name']
             element_type = item['type']
             
             print(f"\n--- Searching for [{element_type}]: {point} ---")
             
-            search_query = f"({condition}) AND ({point}) AND (Guideline[pt] OR Systematic Review[pt])"
-            results = self.search_pubmed(search_query, retmax=3)
-            
             # Helper function to append to evidence bank
             def save_evidence(citation, point_name, elem_type):
-                self.evidence_bank.append({
-                    "id": citation, 
-                    "decision_point": point_name,
-                    "element_type": elem_type
-                })
+                # Element types come from a handful of values and names repeat per citation, so share one string each
+                self.evidence_bank.append(EvidenceRecord(id=citation, decision_point=sys.intern(point_name), element_type=sys.intern(elem_type)))
 
             if results:
-                print(f"Found {len(results)} potential sources:")
-                for i, citation in enumerate(results, 1):
-                    print(f"{i}. {citation}")
+                choices = {str(i): citation for i, citation in enumerate(results, 1)}
+                sys.stdout.write(f"Found {len(results)} potential sources:\n"
+                                 + "".join(f"{i}. {citation}\n" for i, citation in choices.items()))
                 
-                sel = input("Enter number to select (or type manual citation): ")
-                if sel.isdigit() and 1 <= int(sel) <= len(results):
-                    save_evidence(results[int(sel)-1], point, element_type)
-                else:
-                    save_evidence(sel, point, element_type)
+                while True:
+                    sel = self._ask("citation_choice", "Enter number to select (or type manual citation): ",
+                                    element=(index, point)).strip()
+                    if sel in choices:
+                        save_evidence(choices[sel], point, element_type)
+                        break
+                    if sel and not sel.isdigit():
+                        save_evidence(sel, point, element_type)
+                        break
+                    if self._manifest_answer("citation_choice", (index, point)) is not None:
+                        sys.exit(f"Error: manifest citation_choice {sel!r} for '{point}' is not one of the "
+                                 f"{len(choices)} sources found. Fix the manifest and run again.")
+                    print(f"Please enter a number from 1 to {len(choices)}, or type a citation.")
             else:
                 print("No direct hits found via API.")
-                manual = input("Please enter citation manually: ")
+                manual = self._ask("manual_citation", "Please enter citation manually: ", element=(index, point))
                 save_evidence(manual, point, element_type)
             
+        # The evidence check runs while the user answers the equity questions.
+        verification = background.submit(self.verify_evidence, self.evidence_bank) if self.client else None
+        background.shutdown(wait=False)
+
         self.pathway_data['evidence']['studies'] = self.evidence_bank
         self.assess_health_equity()
 
+        if verification:
+            print("\nChecking the selected evidence against each decision point...")
+            verification.result()
+            for study in self.evidence_bank:
+                if study.verification:
+                    print(f"- {study.decision_point}: {study.verification}")
+
     def phase_3_decision_science(self):
         print(self.dialogue["phase_3_intro"])
-        time.sleep(1)
+        self._pause()
         
-        entry = input("\nWhat is the Pathway Entry Point (Trigger)? ")
-        ends = input("What are the Pathway Endpoints (Disposition)? ")
+        entry = self._ask("entry", "\nWhat is the Pathway Entry Point (Trigger)? ")
+        ends = self._ask("endpoints", "What are the Pathway Endpoints (Disposition)? ")
         
-        print("\nLet's build the decision tree.")
-        print("Note: Every decision node must be supported by evidence.")
+        self._say("\nLet's build the decision tree.", "Note: Every decision node must be supported by evidence.")
         
         logic_nodes = []
         condition_context = self.pathway_data['scope'].get('condition', 'General')
         
-        while True:
-            node = input("Add a Decision Node (or press Enter to finish): ")
-            if not node: break
-            
-            # Execute Literature Search Workflow
-            evidence_str = self.search_evidence_workflow(node, condition_context)
+        # Pass 1: collect the nodes; each literature search starts in the background as soon as it is entered
+        pending = []
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            for node, answers in self._decision_nodes():
+                pending.append((node, answers, pool.submit(self._fetch_candidates, node, condition_context)))
             
-            logic_nodes.append({"node": node, "evidence_link": evidence_str})
+            # Pass 2: confirm the evidence for each node as its search results come in
+            for node, answers, candidates in pending:
+                evidence_str = self.search_evidence_workflow(node, condition_context, candidates.result(), answers)
+                logic_nodes.append(LogicNode(node=node, evidence_link=evidence_str))
         
-        self.pathway_data['logic'] = { "entry": entry, "endpoints": ends, "nodes": logic_nodes }
+        self.pathway_data['logic'] = PathwayLogic(entry=entry, endpoints=ends, nodes=logic_nodes)
+        if logic_nodes:
+            self._node_corpus.update(n.node for n in logic_nodes)
+            self.node_cache.set("names", sorted(self._node_corpus))
         self.validate_logic()
         
-        print("\n[GENERATING PROTOTYPE]")
-        print(f"   [{entry}]\n      |\n      v")
-        for n in logic_nodes:
-            print(f"   <{n['node']}> --> (Evidence: {n['evidence_link']})\n      |\n      v")
-        print(f"   [{ends}]")
+        nodes_block = "".join(f"   <{n.node}> --> (Evidence: {n.evidence_link})\n      |\n      v\n" for n in logic_nodes)
+        sys.stdout.write(self._PROTOTYPE_TEMPLATE.format(entry=entry, nodes_block=nodes_block, ends=ends))
+
+    def _decision_nodes(self):
+        """Yields (node, evidence answers or None): from the manifest's decision_nodes, else typed one by one."""
+        if "decision_nodes" in self.manifest:
+            for item in self.manifest["decision_nodes"]:
+                if isinstance(item, dict):
+                    yield item["node"], item.get("evidence")
+                else:
+                    yield item, None  # no evidence given: ask for it like any other missing answer
+            return
+        if readline:
+            delims = readline.get_completer_delims()
+            readline.set_completer_delims("")  # complete whole node names, spaces included
+            readline.set_completer(self._complete_node)
+            self._bind_tab(True)
+        try:
+            while True:
+                node = input("Add a Decision Node (or press Enter to finish): ")
+                if not node: break
+                yield node, None
+        finally:
+            if readline:
+                self._bind_tab(False)
+                readline.set_completer(None)
+                readline.set_completer_delims(delims)
 
     def phase_4_user_testing(self):
+        condition = self.pathway_data['scope'].get('condition', 'the condition')
         print(self.dialogue["phase_4_intro"])
-        time.sleep(1)
+        self._pause()
         
-        print("\nFirst, let's do a Heuristic Evaluation.")
-        print("(Reference: Nielsen's 10 Usability Heuristics)")
-        issues = input("Please list the Top 3 Usability Issues found: ")
-        mitigation = input("What are your Mitigation Plans for these issues? ")
+        self._say("\nFirst, let's do a Heuristic Evaluation.", "(Reference: Nielsen's 10 Usability Heuristics)")
+        issues = self._ask("usability_issues", "Please list the Top 3 Usability Issues found: ")
+        mitigation = self._ask("mitigation", "What are your Mitigation Plans for these issues? ")
         
-        print("\nNow, running a Workflow Simulation...")
-        print("Simulating 'Silent Mode' pilot data...")
-        time.sleep(1)
-        condition = self.pathway_data['scope'].get('condition', 'the condition')
-        print(f"\nScenario: A provider encounters the decision support for {condition}.")
-        print("Predicted Workflow Impact:\n- Clicks added: 2 (Target: <3)\n- Cognitive Load: Low")
+        self._say("\nNow, running a Workflow Simulation...", "Simulating 'Silent Mode' pilot data...")
+        self._pause()
+        self._say(f"\nScenario: A provider encounters the decision support for {condition}.",
+                  "Predicted Workflow Impact:\n- Clicks added: 2 (Target: <3)\n- Cognitive Load: Low")
         
-        feedback = input("\nDuring the pilot, did providers complain about 'Alert Fatigue'?\n>> (Yes/No): ")
-        status = "Ready for Go-Live" if feedback.lower() == "no" else "Requires Redesign (Too much friction)"
+        feedback = self._ask("alert_fatigue", "\nDuring the pilot, did providers complain about 'Alert Fatigue'?\n>> (Yes/No): ")
+        status = "Ready for Go-Live" if feedback.strip().casefold() in self._NEGATIVE_ANSWERS else "Requires Redesign (Too much friction)"
         print(f"Validation Status: {status}")
         
-        self.pathway_data['testing'] = { "method": "Heuristic Evaluation + Workflow Sim", "issues": issues, "mitigation": mitigation, "pilot_fatigue_feedback": feedback, "status": status }
+        self.pathway_data['testing'] = TestingResult(method="Heuristic Evaluation + Workflow Sim", issues=issues, mitigation=mitigation, pilot_fatigue_feedback=feedback, status=status)
 
     def phase_5_operationalization(self):
+        condition_upper = self.pathway_data['scope'].get('condition', 'N/A').upper()
         print(self.dialogue["phase_5_intro"])
-        time.sleep(1)
+        self._pause()
         
-        ehr = input("\nWhich EHR System will this live in? (e.g., Epic, Cerner): ")
-        tools = input("What specific CDS Tools will we use? (e.g., Order Sets, BPAs): ")
-        tool_link = input(f"How does '{tools}' support the decision nodes we defined? ")
-        metrics = input("Finally, please define 3 Key Performance Indicators (KPIs): ")
+        ehr = self._ask("ehr", "\nWhich EHR System will this live in? (e.g., Epic, Cerner): ")
+        tools = self._ask("cds_tools", "What specific CDS Tools will we use? (e.g., Order Sets, BPAs): ")
+        tool_link = self._ask("tool_link", f"How does '{tools}' support the decision nodes we defined? ")
+        metrics = self._ask("kpis", "Finally, please define 3 Key Performance Indicators (KPIs): ")
         
-        print("\nHere is a draft of the Dashboard Wireframe:")
-        print("|----------------------------------------|")
-        print(f"| PATHWAY: {self.pathway_data['scope'].get('condition', 'N/A').upper()}     |")
-        print("|----------------------------------------|")
-        print(f"| KPI 1: {metrics.split(',')[0] if ',' in metrics else metrics}     |")
-        print("| Adoption Rate: [ GRAPH ]               |")
-        print("|----------------------------------------|")
+        kpis = [kpi.strip() for kpi in metrics.split(',') if kpi.strip()]
+        sys.stdout.write(self._DASHBOARD_TEMPLATE.format(
+            condition=condition_upper,
+            kpi1=kpis[0] if kpis else "N/A"
+        ))
         
-        self.pathway_data['operations'] = { "ehr": ehr, "tools": tools, "tool_link": tool_link, "metrics": metrics }
+        self.pathway_data['operations'] = OperationsPlan(ehr=ehr, tools=tools, tool_link=tool_link, metrics=metrics, kpis=kpis)
 
     def generate_final_report(self):
-        print("\n" + "="*60)
-        print("PROCESS COMPLETE")
-        print(f"All formal summaries have been saved to '{self.report_file}'")
-        print("="*60)
+        # Write the report file while the closing banner prints; execute_process joins the writer
+        self._report_writer = threading.Thread(target=self._flush_report)
+        self._report_writer.start()
+        self._say("\n" + "="*60, "PROCESS COMPLETE", f"All formal summaries have been saved to '{self.report_file}'", "="*60)
 
 
 if __name__ == "__main__":
-    agent = ClinicalPathwayAgent()
+    parser = argparse.ArgumentParser(description="Guide a clinical team through pathway development.")
+    parser.add_argument("--manifest", help="JSON file of answers for a non-interactive (batch) run")
+    args = parser.parse_args()
+    manifest = None
+    if args.manifest:
+        with open(args.manifest) as f:
+            manifest = json.load(f)
+    agent = ClinicalPathwayAgent(manifest)
     agent.execute_process()